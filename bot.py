@@ -1,12 +1,49 @@
 import asyncio
+import hashlib
+import logging
+import sys
+import time
 from aiohttp import web
-from db import dp, bot, init_db, close_db
-from config import WEBHOOK_SECRET, RAILWAY_STATIC_URL
-from handlers import start, tasks, family, history, shopping, settings
-from scheduler import schedule_daily_digest
+from aiogram.filters import ExceptionTypeFilter
+from aiogram.methods import TelegramMethod
+from aiogram.types import ErrorEvent
+from db import dp, bot, init_db, close_db, db_ready, db_connection_middleware, DatabaseUnavailable, UNAVAILABLE_TEXT
+from config import WEBHOOK_SECRET, RAILWAY_STATIC_URL, DRAIN_TIMEOUT, LOG_LEVEL, ADMIN_TOKEN
+from handlers import start, tasks, family, history, shopping, settings, search, checklist, export, stats, recurring, reminders, bulk
+from fsm_storage import schedule_sweep
+from scheduler import schedule_daily_digest, schedule_stats_rollup, schedule_archiver
+from recurring import schedule_recurring_tasks
+from reminders import schedule_reminders
+import drain
+import metrics
+import tracing
+import profiling
+import invalidation
+from throttling import throttle_middleware
+from dedup import dedup_middleware
+from callbacks import route_callback
+from menu import route_menu
+from log import setup_logging, log_context_middleware
+
+setup_logging(LOG_LEVEL)
+tracing.setup_tracing()
+logger = logging.getLogger(__name__)
+
+# Момент старта процесса - от него считаем тайминги запуска
+PROCESS_START = time.perf_counter()
 
 WEBHOOK_PATH = "/webhook"
-WEBHOOK_URL = f"https://{RAILWAY_STATIC_URL}{WEBHOOK_PATH}"
+# Отпечаток секрета в URL: getWebhookInfo не возвращает secret_token,
+# а так смена секрета меняет URL и webhook будет переустановлен
+WEBHOOK_FINGERPRINT = hashlib.sha256((WEBHOOK_SECRET or "").encode()).hexdigest()[:12]
+WEBHOOK_URL = f"https://{RAILWAY_STATIC_URL}{WEBHOOK_PATH}?v={WEBHOOK_FINGERPRINT}"
+
+# Сколько апдейт может ждать готовности базы, прежде чем Telegram повторит его
+DB_WAIT_TIMEOUT = 30
+
+# Сколько раз повторять шаг запуска и первая пауза между попытками (дальше удваивается)
+STARTUP_ATTEMPTS = 6
+STARTUP_RETRY_DELAY = 2
 
 dp.include_router(start.router)
 dp.include_router(tasks.router)
@@ -14,39 +51,251 @@ dp.include_router(shopping.router)
 dp.include_router(family.router)
 dp.include_router(history.router)
 dp.include_router(settings.router)
+dp.include_router(search.router)
+dp.include_router(checklist.router)
+dp.include_router(export.router)
+dp.include_router(stats.router)
+dp.include_router(recurring.router)
+dp.include_router(reminders.router)
+dp.include_router(bulk.router)
 
-async def on_startup():
-    await init_db()
-    await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
-    print("Database initialized")
-    print("Webhook set")
+_warm_up_task = None
+_main_task = None
+_startup_failed = False
+_scheduler_tasks = []
+_webhook_ready = False
+
+
+async def wait_for_db(handler, event, data):
+    """Придержать апдейты, пришедшие до открытия пула"""
+    if not db_ready.is_set():
+        try:
+            await asyncio.wait_for(db_ready.wait(), DB_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise DatabaseUnavailable()
+    return await handler(event, data)
+
+
+# Первый зарегистрированный outer-middleware выполняется снаружи: ждать базу
+# нужно раньше, чем dedup и соединение апдейта обратятся к пулу
+dp.update.outer_middleware(log_context_middleware)
+dp.update.outer_middleware(tracing.trace_update)
+dp.update.outer_middleware(drain.track_update)
+dp.update.outer_middleware(wait_for_db)
+dp.update.outer_middleware(db_connection_middleware)
+dp.update.outer_middleware(dedup_middleware)
+dp.message.outer_middleware(route_menu)
+dp.callback_query.outer_middleware(route_callback)
+dp.message.middleware(throttle_middleware)
+dp.callback_query.middleware(throttle_middleware)
+dp.message.middleware(tracing.trace_handler)
+dp.callback_query.middleware(tracing.trace_handler)
+
+profiling.register_runtime_gauges(dp.storage)
+
+
+@dp.update.outer_middleware()
+async def count_webhook_replies(handler, event, data):
+    """Считать ответы, отданные прямо в HTTP-ответе на webhook"""
+    result = await handler(event, data)
+    if isinstance(result, TelegramMethod):
+        metrics.inc("telegram_webhook_replies_total", method=type(result).__name__)
+    return result
+
+
+@dp.errors(ExceptionTypeFilter(DatabaseUnavailable))
+async def database_unavailable(event: ErrorEvent):
+    """База недоступна: быстро ответить вместо трассировки в логе"""
+    metrics.inc("db_unavailable_replies_total")
+    update = event.update
+    if update.callback_query:
+        return update.callback_query.answer(UNAVAILABLE_TEXT, show_alert=True)
+    if update.message:
+        return update.message.answer(UNAVAILABLE_TEXT)
+    return True
+
+
+@dp.errors()
+async def unhandled_error(event: ErrorEvent):
+    """Остальные ошибки: записать и ответить webhook 200
     
-    # Запускаем планировщик дайджестов
-    asyncio.create_task(schedule_daily_digest())
-    print("Daily digest scheduler started")
+    Иначе Telegram повторит апдейт, и уже сделанные записи задвоятся
+    (dedup такой update_id не отпускает).
+    """
+    logger.error(
+        "Update failed", exc_info=event.exception,
+        extra={"update_id": event.update.update_id}
+    )
+    metrics.inc("updates_failed_total")
+    if event.update.callback_query:
+        return event.update.callback_query.answer("❌ Произошла ошибка")
+    return True
+
+
+async def count_api_requests(make_request, bot, method):
+    """Считать исходящие запросы к Bot API"""
+    metrics.inc("telegram_api_requests_total", method=type(method).__name__)
+    return await make_request(bot, method)
+
+
+bot.session.middleware(count_api_requests)
+bot.session.middleware(tracing.trace_api_request)
+
+
+async def timed(phase: str, coro, timings: dict):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        timings[phase] = time.perf_counter() - started
+
+
+async def ensure_webhook():
+    """Установить webhook, только если он отличается от нужного"""
+    global _webhook_ready
+    info = await bot.get_webhook_info()
+    if info.url == WEBHOOK_URL:
+        logger.info("Webhook already set, skipping set_webhook")
+    else:
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        logger.info("Webhook set")
+    _webhook_ready = True
+
+
+async def retrying(phase: str, step, cleanup=None):
+    """Выполнить шаг запуска, повторяя его с растущей паузой"""
+    delay = STARTUP_RETRY_DELAY
+    for attempt in range(1, STARTUP_ATTEMPTS + 1):
+        try:
+            return await step()
+        except Exception as e:
+            if attempt == STARTUP_ATTEMPTS:
+                raise
+            logger.warning(
+                "Startup step failed, retrying: %s", e,
+                extra={"phase": phase, "attempt": attempt, "retry_in": delay}
+            )
+            if cleanup:
+                await cleanup()
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+async def warm_up():
+    """Открыть базу и проверить webhook параллельно, уже принимая трафик
+    
+    Если шаг так и не удался, останавливаем процесс с ненулевым кодом:
+    живой, но не готовый процесс платформа не перезапустит.
+    """
+    global _startup_failed
+    timings = {}
+    try:
+        await asyncio.gather(
+            timed("db", retrying("db", init_db, cleanup=close_db), timings),
+            timed("webhook", retrying("webhook", ensure_webhook), timings),
+        )
+    except Exception:
+        logger.exception("Startup failed, exiting")
+        _startup_failed = True
+        _main_task.cancel()
+        return
+    logger.info("Database initialized")
+
+    # Запускаем фоновые задания: дайджест, статистика, повторы, напоминания, архив, LISTEN
+    _scheduler_tasks.append(asyncio.create_task(schedule_daily_digest()))
+    _scheduler_tasks.append(asyncio.create_task(schedule_stats_rollup()))
+    _scheduler_tasks.append(asyncio.create_task(schedule_recurring_tasks()))
+    _scheduler_tasks.append(asyncio.create_task(schedule_reminders()))
+    _scheduler_tasks.append(asyncio.create_task(schedule_archiver()))
+    _scheduler_tasks.append(asyncio.create_task(invalidation.listen()))
+    logger.info("Daily digest scheduler started")
+    logger.info("Stats rollup scheduler started")
+    logger.info("Recurring tasks scheduler started")
+    logger.info("Reminder dispatcher started")
+    logger.info("Archiver started")
+    logger.info("Cache invalidation listener started")
+
+    total = time.perf_counter() - PROCESS_START
+    breakdown = {f"{phase}_ms": round(seconds * 1000) for phase, seconds in timings.items()}
+    logger.info("Startup complete", extra={"duration_ms": round(total * 1000), **breakdown})
+
+
+async def on_startup():
+    global _warm_up_task
+    _warm_up_task = asyncio.create_task(warm_up())
+    # Чистка FSM не зависит от базы
+    _scheduler_tasks.append(asyncio.create_task(schedule_sweep(dp.storage)))
+    profiling.loop_monitor.start()
+    logger.info("Accepting traffic", extra={"after_ms": round((time.perf_counter() - PROCESS_START) * 1000)})
 
 async def on_shutdown():
-    await bot.delete_webhook()
+    if _warm_up_task and not _warm_up_task.done():
+        _warm_up_task.cancel()
+    for task in _scheduler_tasks:
+        # Ожидание следующего запуска прерываем, идущую работу - нет
+        task.cancel()
+    
+    profiling.loop_monitor.stop()
+
+    # Webhook не удаляем: его подхватит новая реплика
+    await drain.drain(DRAIN_TIMEOUT)
     await close_db()
-    print("Database closed")
+    logger.info("Database closed")
+
+
+async def healthz(request: web.Request):
+    """Процесс жив и обслуживает HTTP"""
+    return web.json_response({"status": "ok"})
+
+
+async def readyz(request: web.Request):
+    """Готов обрабатывать апдейты: база открыта, webhook проверен"""
+    ready = db_ready.is_set() and _webhook_ready
+    return web.json_response(
+        {"db": db_ready.is_set(), "webhook": _webhook_ready},
+        status=200 if ready else 503
+    )
+
+
+@profiling.admin_only
+async def metrics_endpoint(request: web.Request):
+    """Метрики в текстовом формате Prometheus (с тем же токеном, что /admin/*)"""
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
 
 async def main():
+    global _main_task
+    _main_task = asyncio.current_task()
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
 
     from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-    app = web.Application()
+    app = web.Application(middlewares=[drain.reject_when_draining(WEBHOOK_PATH)])
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    if ADMIN_TOKEN:
+        app.router.add_get("/metrics", metrics_endpoint)
+    profiling.setup_admin_routes(app)
 
+    # Обработчики возвращают последний ответ (message.answer(...) без await),
+    # и он уходит в теле ответа на webhook - без отдельного запроса к Bot API
     SimpleRequestHandler(
         dispatcher=dp,
         bot=bot,
         secret_token=WEBHOOK_SECRET,
+        handle_in_background=False,
     ).register(app, path=WEBHOOK_PATH)
 
     setup_application(app, dp, bot=bot)
 
-    await web._run_app(app, host="0.0.0.0", port=8080)
+    try:
+        await web._run_app(app, host="0.0.0.0", port=8080)
+    except asyncio.CancelledError:
+        if not _startup_failed:
+            raise
+        # Ненулевой код: сработает restartPolicy ON_FAILURE
+        sys.exit(1)
 
 if __name__ == "__main__":
     asyncio.run(main())
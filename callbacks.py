@@ -0,0 +1,179 @@
+"""
+Callback-кнопки: фабрики CallbackData и маршрутизация по префиксу
+
+Префикс callback_data ищется в словаре один раз на апдейт, данные
+разбираются в типизированный объект и кладутся в data["callback_data"].
+Фильтр Route у хендлера после этого - одно сравнение типа, без разбора строки.
+"""
+from typing import Optional
+from aiogram.filters import Filter
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+import metrics
+
+
+# Добавление задачи или покупки
+class Suggest(CallbackData, prefix="suggest"):
+    index: int
+
+
+class Confirm(CallbackData, prefix="confirm"):
+    kind: str
+
+
+class Assign(CallbackData, prefix="assign"):
+    kind: str
+    # None - назначить всем
+    user_id: Optional[int] = None
+
+
+# Выполнение
+class TaskDone(CallbackData, prefix="task_done"):
+    id: int
+
+
+class ShopDone(CallbackData, prefix="shop_done"):
+    id: int
+
+
+class Bulk(CallbackData, prefix="bulk"):
+    kind: str
+
+
+class BulkToggle(CallbackData, prefix="bulk_toggle"):
+    kind: str
+    id: int
+
+
+class BulkDone(CallbackData, prefix="bulk_done"):
+    kind: str
+    # selected - отмеченные, all - все показанные
+    scope: str
+
+
+class BulkCancel(CallbackData, prefix="bulk_cancel"):
+    pass
+
+
+# Чек-листы
+class Checklist(CallbackData, prefix="checklist"):
+    kind: str
+    id: int
+
+
+class CheckToggle(CallbackData, prefix="check_toggle"):
+    kind: str
+    id: int
+
+
+class CheckUp(CallbackData, prefix="check_up"):
+    kind: str
+    id: int
+
+
+class CheckAdd(CallbackData, prefix="check_add"):
+    kind: str
+    parent_id: int
+
+
+# Сроки и повторы
+class Due(CallbackData, prefix="due"):
+    kind: str
+    id: int
+
+
+class DueSet(CallbackData, prefix="due_set"):
+    kind: str
+    id: int
+    option: str
+
+
+class RepeatDel(CallbackData, prefix="repeat_del"):
+    id: int
+
+
+# Семья и настройки
+class ChangeRole(CallbackData, prefix="change_role"):
+    user_id: int
+    role: str
+
+
+class RemoveMember(CallbackData, prefix="remove_member"):
+    user_id: int
+
+
+class Emoji(CallbackData, prefix="emoji"):
+    target: str
+
+
+# История, поиск, статистика
+class HistoryPage(CallbackData, prefix="history"):
+    filter_type: str
+    # None - старая кнопка вида history:<page>
+    page: Optional[int] = None
+
+
+class HistoryFilter(CallbackData, prefix="history_filter"):
+    filter_type: str
+    page: int
+
+
+class SearchPage(CallbackData, prefix="search"):
+    filter_type: str
+    # Курсор: ранг и id последней показанной записи
+    rank: Optional[float] = None
+    after_id: Optional[int] = None
+
+
+class Stats(CallbackData, prefix="stats"):
+    period: str
+
+
+CALLBACKS = {
+    cls.__prefix__: cls
+    for cls in (
+        Suggest, Confirm, Assign, TaskDone, ShopDone, Bulk, BulkToggle, BulkDone, BulkCancel,
+        Checklist, CheckToggle, CheckUp, CheckAdd, Due, DueSet, RepeatDel,
+        ChangeRole, RemoveMember, Emoji, HistoryPage, HistoryFilter, SearchPage, Stats
+    )
+}
+
+
+def parse(data: str):
+    """Разобрать callback_data по префиксу; None - неизвестная или битая кнопка"""
+    cls = CALLBACKS.get(data.partition(":")[0])
+    if cls is None:
+        return None
+
+    # Необязательные поля в конце можно не передавать (старые кнопки)
+    missing = len(cls.model_fields) - data.count(":")
+    if missing > 0:
+        data += ":" * missing
+
+    # Старая кнопка "Всем": assign:<kind>:all
+    if cls is Assign and data.endswith(":all"):
+        data = data[:-len("all")]
+
+    try:
+        return cls.unpack(data)
+    except (TypeError, ValueError):
+        return None
+
+
+async def route_callback(handler, event: CallbackQuery, data: dict):
+    """Outer-middleware: разобрать callback_data один раз на апдейт"""
+    payload = parse(event.data or "")
+    if payload is None:
+        metrics.inc("callback_unrouted_total")
+    data["callback_data"] = payload
+    return await handler(event, data)
+
+
+class Route(Filter):
+    """Фильтр: кнопка разобрана в фабрику cls"""
+
+    def __init__(self, cls):
+        self.cls = cls
+
+    async def __call__(self, callback: CallbackQuery, callback_data=None) -> bool:
+        return type(callback_data) is self.cls
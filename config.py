@@ -5,5 +5,39 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Необязательная реплика для тяжёлых чтений (история, дайджест, статистика)
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 RAILWAY_STATIC_URL = os.getenv("RAILWAY_STATIC_URL")
+
+# Через сколько дней выполненные задачи и покупки переносятся в архив
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+
+# Общая для реплик таблица обработанных update_id (иначе - только память процесса)
+DEDUP_SHARED = os.getenv("DEDUP_SHARED", "").lower() in ("1", "true", "yes")
+
+# Сколько секунд при остановке ждать текущие апдейты и рассылки
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+
+# Уровень логов (DEBUG, INFO, WARNING, ...)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Трассировка: доля трассируемых апдейтов, порог медленной трассы и файл для них
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# Размер файла трасс, после которого он ротируется
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(50 * 2**20)))
+
+# Токен для админских маршрутов (/admin/...); без него они отключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Сколько миллисекунд event loop может быть занят, прежде чем пишем его стек в лог
+LOOP_LAG_MS = float(os.getenv("LOOP_LAG_MS", "200"))
+
+# Сколько секунд ждать соединение из пула и выполнение одного запроса
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "3"))
+DB_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", "5"))
+
+# Незавершённые диалоги (FSM): сколько секунд храним с последнего действия и сколько всего
+FSM_TTL = float(os.getenv("FSM_TTL", "3600"))
+FSM_MAX_ENTRIES = int(os.getenv("FSM_MAX_ENTRIES", "10000"))
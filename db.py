@@ -1,21 +1,143 @@
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import asynccontextmanager
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN, DATABASE_URL
+from config import BOT_TOKEN, DATABASE_URL, DATABASE_REPLICA_URL, DB_ACQUIRE_TIMEOUT, DB_STATEMENT_TIMEOUT
 import asyncpg
+import metrics
+import tracing
+from log import bind_member
+from fsm_storage import BoundedMemoryStorage
+
+logger = logging.getLogger(__name__)
 
 bot = Bot(BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=BoundedMemoryStorage())
 
 # Пул соединений с базой данных
 _pool = None
 
+# Пул реплики для чтений, которым не нужна свежая запись
+_replica_pool = None
+# До какого момента (time.monotonic) считаем реплику недоступной
+_replica_down_until = 0.0
+
+# Сколько ждать соединение реплики и на сколько её отключать после сбоя
+REPLICA_ACQUIRE_TIMEOUT = 2
+REPLICA_RETRY_AFTER = 30
+
+# Выставляется, когда пул открыт и схема проверена
+db_ready = asyncio.Event()
+
+# Сколько сбоев подряд размыкают предохранитель и как часто он проверяет базу
+BREAKER_THRESHOLD = 5
+BREAKER_PROBE_INTERVAL = 5
+
+# Ошибки, которые говорят о недоступности базы, а не о самом запросе
+_DB_FAILURES = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.QueryCanceledError,
+    asyncpg.ConnectionDoesNotExistError,
+)
+
+
+class DatabaseUnavailable(Exception):
+    """База недоступна: предохранитель разомкнут или запрос не дождался ответа"""
+
+    def __init__(self):
+        super().__init__("база временно недоступна")
+
+
+# Сбои, после которых повтор апдейта безопасен: транзакция не прошла
+TRANSIENT_ERRORS = (DatabaseUnavailable,) + _DB_FAILURES
+
+
+# Что отвечаем пользователю, пока база недоступна
+UNAVAILABLE_TEXT = "⚠️ База временно недоступна, изменения сейчас не сохраняются. Попробуйте через минуту."
+
+
+class CircuitBreaker:
+    """Предохранитель основной базы
+
+    После BREAKER_THRESHOLD сбоев подряд размыкается: соединения не выдаются
+    сразу, без ожидания таймаутов. Фоновая проверка раз в BREAKER_PROBE_INTERVAL
+    делает SELECT 1 и замыкает его, как только база ответила.
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.open = False
+        self._probe_task = None
+
+    def success(self):
+        self.failures = 0
+
+    def failure(self, error: BaseException):
+        self.failures += 1
+        if self.open or self.failures < BREAKER_THRESHOLD:
+            return
+        self.open = True
+        metrics.inc("db_breaker_trips_total")
+        logger.error("Database circuit breaker opened: %s", error)
+        self._probe_task = asyncio.create_task(self._probe())
+
+    def check(self):
+        if self.open:
+            metrics.inc("db_breaker_rejections_total")
+            raise DatabaseUnavailable()
+
+    async def _probe(self):
+        while self.open:
+            await asyncio.sleep(BREAKER_PROBE_INTERVAL)
+            try:
+                async with _pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+                    await conn.fetchval("SELECT 1", timeout=DB_ACQUIRE_TIMEOUT)
+            except _DB_FAILURES as e:
+                logger.warning("Database probe failed: %s", e)
+                continue
+            self.open = False
+            self.failures = 0
+            logger.info("Database circuit breaker closed")
+
+
+breaker = CircuitBreaker()
+metrics.register_gauge("db_breaker_open", lambda: int(breaker.open))
+
+
+def db_available() -> bool:
+    return not breaker.open
+
+
+@asynccontextmanager
+async def _schema_connection():
+    """Отдельное соединение для миграций: без statement_timeout пула
+    
+    Перестройка таблицы и сборка индексов на большой базе идут дольше
+    DB_STATEMENT_TIMEOUT.
+    """
+    conn = await asyncpg.connect(DATABASE_URL, command_timeout=None)
+    try:
+        yield conn
+    finally:
+        await conn.close()
+
 
 async def init_db():
     """Инициализация пула соединений и создание таблиц"""
     global _pool
-    _pool = await asyncpg.create_pool(DATABASE_URL)
+    # Остальные соединения пул откроет по мере надобности
+    _pool = await asyncpg.create_pool(
+        DATABASE_URL, min_size=1, init=tracing.instrument_connection,
+        command_timeout=DB_STATEMENT_TIMEOUT,
+        server_settings={'statement_timeout': str(int(DB_STATEMENT_TIMEOUT * 1000))}
+    )
     
-    async with _pool.acquire() as conn:
+    async with _schema_connection() as conn:
         # Таблица семей
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS families (
@@ -197,6 +319,266 @@ async def init_db():
             await conn.execute("ALTER TABLE families ADD COLUMN IF NOT EXISTS emoji_add TEXT DEFAULT '➕'")
         except:
             pass
+        
+        # Полнотекстовый поиск по истории (/search)
+        try:
+            await conn.execute(
+                """ALTER TABLE activity_log ADD COLUMN IF NOT EXISTS action_tsv tsvector
+                   GENERATED ALWAYS AS (to_tsvector('russian', action)) STORED"""
+            )
+        except:
+            pass
+        
+        try:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_activity_log_tsv ON activity_log USING GIN (action_tsv)"
+            )
+        except:
+            pass
+        
+        # Индексы для загрузки чек-листов страницы одним запросом
+        try:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_task_checklist_task ON task_checklist (task_id, position)"
+            )
+        except:
+            pass
+        
+        try:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_shopping_checklist_shopping ON shopping_checklist (shopping_id, position)"
+            )
+        except:
+            pass
+        
+        # Кто отметил выполнение - для статистики по участникам
+        try:
+            await conn.execute("ALTER TABLE tasks ADD COLUMN IF NOT EXISTS completed_by BIGINT")
+        except:
+            pass
+        
+        try:
+            await conn.execute("ALTER TABLE shopping ADD COLUMN IF NOT EXISTS completed_by BIGINT")
+        except:
+            pass
+        
+        # Дневные агрегаты статистики, пополняются фоновым заданием
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS member_daily_stats (
+                family_id INTEGER REFERENCES families(id) ON DELETE CASCADE,
+                user_id BIGINT NOT NULL,
+                day DATE NOT NULL,
+                kind TEXT NOT NULL,
+                completed INTEGER DEFAULT 0,
+                total_seconds DOUBLE PRECISION DEFAULT 0,
+                PRIMARY KEY (family_id, day, user_id, kind)
+            )
+        """)
+        
+        # Докуда агрегаты уже посчитаны
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats_watermark (
+                name TEXT PRIMARY KEY,
+                value TIMESTAMP NOT NULL
+            )
+        """)
+        
+        try:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_completed_at ON tasks (completed_at) WHERE completed"
+            )
+        except:
+            pass
+        
+        try:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_shopping_completed_at ON shopping (completed_at) WHERE completed"
+            )
+        except:
+            pass
+        
+        # Шаблоны повторяющихся задач и покупок (schedule - выражение cron)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS recurring_tasks (
+                id SERIAL PRIMARY KEY,
+                family_id INTEGER REFERENCES families(id) ON DELETE CASCADE,
+                kind TEXT NOT NULL DEFAULT 'task',
+                text TEXT NOT NULL,
+                schedule TEXT NOT NULL,
+                next_run_at TIMESTAMP NOT NULL,
+                assigned_to BIGINT,
+                created_by BIGINT,
+                active BOOLEAN DEFAULT TRUE,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        
+        try:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_recurring_tasks_next_run ON recurring_tasks (next_run_at) WHERE active"
+            )
+        except:
+            pass
+        
+        # Сроки и напоминания: диспетчер опрашивает частичный индекс по remind_at
+        try:
+            await conn.execute("ALTER TABLE tasks ADD COLUMN IF NOT EXISTS due_at TIMESTAMP")
+        except:
+            pass
+        
+        try:
+            await conn.execute("ALTER TABLE tasks ADD COLUMN IF NOT EXISTS remind_at TIMESTAMP")
+        except:
+            pass
+        
+        try:
+            await conn.execute("ALTER TABLE tasks ADD COLUMN IF NOT EXISTS reminded BOOLEAN DEFAULT FALSE")
+        except:
+            pass
+        
+        try:
+            await conn.execute("ALTER TABLE shopping ADD COLUMN IF NOT EXISTS due_at TIMESTAMP")
+        except:
+            pass
+        
+        try:
+            await conn.execute("ALTER TABLE shopping ADD COLUMN IF NOT EXISTS remind_at TIMESTAMP")
+        except:
+            pass
+        
+        try:
+            await conn.execute("ALTER TABLE shopping ADD COLUMN IF NOT EXISTS reminded BOOLEAN DEFAULT FALSE")
+        except:
+            pass
+        
+        try:
+            await conn.execute(
+                """CREATE INDEX IF NOT EXISTS idx_tasks_remind_at ON tasks (remind_at)
+                   WHERE NOT completed AND NOT reminded"""
+            )
+        except:
+            pass
+        
+        try:
+            await conn.execute(
+                """CREATE INDEX IF NOT EXISTS idx_shopping_remind_at ON shopping (remind_at)
+                   WHERE NOT completed AND NOT reminded"""
+            )
+        except:
+            pass
+        
+        # Обработанные update_id для подавления ретраев между репликами
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed_updates (
+                update_id BIGINT PRIMARY KEY,
+                seen_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        
+        # Архив выполненных задач и покупок: горячие таблицы держат только активное
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks_archive (
+                id INTEGER PRIMARY KEY,
+                family_id INTEGER REFERENCES families(id) ON DELETE CASCADE,
+                text TEXT NOT NULL,
+                completed BOOLEAN,
+                created_at TIMESTAMP,
+                completed_at TIMESTAMP,
+                assigned_to BIGINT,
+                created_by BIGINT,
+                completed_by BIGINT,
+                due_at TIMESTAMP
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_checklist_archive (
+                id INTEGER PRIMARY KEY,
+                task_id INTEGER REFERENCES tasks_archive(id) ON DELETE CASCADE,
+                text TEXT NOT NULL,
+                completed BOOLEAN,
+                position INTEGER
+            )
+        """)
+        
+        try:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_archive_family ON tasks_archive (family_id, completed_at)"
+            )
+        except:
+            pass
+        
+        # Горячая и архивная части вместе - для выгрузки и подсказок
+        await conn.execute("""
+            CREATE OR REPLACE VIEW tasks_all AS
+            SELECT id, family_id, text, completed, created_at, completed_at,
+                   assigned_to, created_by, completed_by, due_at
+            FROM tasks
+            UNION ALL
+            SELECT id, family_id, text, completed, created_at, completed_at,
+                   assigned_to, created_by, completed_by, due_at
+            FROM tasks_archive
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS shopping_archive (
+                id INTEGER PRIMARY KEY,
+                family_id INTEGER REFERENCES families(id) ON DELETE CASCADE,
+                text TEXT NOT NULL,
+                completed BOOLEAN,
+                created_at TIMESTAMP,
+                completed_at TIMESTAMP,
+                assigned_to BIGINT,
+                created_by BIGINT,
+                completed_by BIGINT,
+                due_at TIMESTAMP
+            )
+        """)
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS shopping_checklist_archive (
+                id INTEGER PRIMARY KEY,
+                shopping_id INTEGER REFERENCES shopping_archive(id) ON DELETE CASCADE,
+                text TEXT NOT NULL,
+                completed BOOLEAN,
+                position INTEGER
+            )
+        """)
+        
+        try:
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_shopping_archive_family ON shopping_archive (family_id, completed_at)"
+            )
+        except:
+            pass
+        
+        # Горячая и архивная части вместе - для выгрузки и подсказок
+        await conn.execute("""
+            CREATE OR REPLACE VIEW shopping_all AS
+            SELECT id, family_id, text, completed, created_at, completed_at,
+                   assigned_to, created_by, completed_by, due_at
+            FROM shopping
+            UNION ALL
+            SELECT id, family_id, text, completed, created_at, completed_at,
+                   assigned_to, created_by, completed_by, due_at
+            FROM shopping_archive
+        """)
+    
+    if DATABASE_REPLICA_URL:
+        await init_replica()
+    
+    db_ready.set()
+
+
+async def init_replica():
+    """Открыть пул реплики; без неё всё читается с основной базы"""
+    global _replica_pool, _replica_down_until
+    try:
+        _replica_pool = await asyncpg.create_pool(DATABASE_REPLICA_URL, min_size=1, init=tracing.instrument_connection)
+        logger.info("Replica pool initialized")
+    except Exception as e:
+        _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+        logger.warning("Replica unavailable, reading from primary: %s", e)
 
 
 def get_pool():
@@ -204,9 +586,204 @@ def get_pool():
     return _pool
 
 
+# Соединение текущего апдейта (см. db_connection_middleware)
+_update_conn = contextvars.ContextVar("update_conn", default=None)
+
+
+async def _acquire():
+    """Взять соединение из пула, учитывая время ожидания в метриках
+
+    Ждём не дольше DB_ACQUIRE_TIMEOUT; при разомкнутом предохранителе сразу
+    DatabaseUnavailable. Предохранитель считает только ошибки самой базы,
+    а не ожидание свободного соединения.
+    """
+    breaker.check()
+    if _pool is None:
+        # Пул ещё не открыт (запуск) или уже закрыт
+        raise DatabaseUnavailable()
+    started = time.perf_counter()
+    try:
+        conn = await _pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError as e:
+        # Пул занят долгими апдейтами - база при этом может быть здорова,
+        # поэтому предохранитель не трогаем
+        metrics.inc("db_pool_wait_timeouts_total")
+        logger.warning("Timed out waiting for a pool connection")
+        raise DatabaseUnavailable() from e
+    except _DB_FAILURES as e:
+        breaker.failure(e)
+        raise DatabaseUnavailable() from e
+    metrics.inc("db_pool_acquires_total")
+    metrics.inc("db_pool_wait_seconds_total", time.perf_counter() - started)
+    return conn
+
+
+class UpdateConnection:
+    """Одно соединение на апдейт: берётся из пула при первом обращении
+    и возвращается, когда апдейт обработан"""
+
+    def __init__(self):
+        self.conn = None
+        self.tx = None
+
+    async def get(self):
+        if self.conn is None:
+            self.conn = await _acquire()
+        return self.conn
+
+    async def begin(self):
+        """Открыть транзакцию до конца апдейта (коммит, если обработчик не упал)"""
+        conn = await self.get()
+        if self.tx is None:
+            self.tx = conn.transaction()
+            await self.tx.start()
+        return conn
+
+    async def release(self, failed: bool = False):
+        if self.conn is None:
+            return
+        try:
+            if self.tx is not None:
+                if failed:
+                    await self.tx.rollback()
+                else:
+                    await self.tx.commit()
+        finally:
+            conn, self.conn, self.tx = self.conn, None, None
+            await _pool.release(conn)
+
+
+@asynccontextmanager
+async def connection():
+    """Соединение с основной базой: общее соединение апдейта или своё из пула
+    
+    Таймауты и обрывы учитывает предохранитель и превращает в DatabaseUnavailable.
+    """
+    holder = _update_conn.get()
+    if holder is not None:
+        conn = await holder.get()
+        try:
+            yield conn
+        except _DB_FAILURES as e:
+            breaker.failure(e)
+            raise DatabaseUnavailable() from e
+        breaker.success()
+        return
+    
+    conn = await _acquire()
+    try:
+        yield conn
+    except _DB_FAILURES as e:
+        breaker.failure(e)
+        raise DatabaseUnavailable() from e
+    else:
+        breaker.success()
+    finally:
+        await _pool.release(conn)
+
+
+async def begin_update_transaction():
+    """Выполнить остаток апдейта в одной транзакции"""
+    holder = _update_conn.get()
+    if holder is not None:
+        await holder.begin()
+
+
+def detach_update_connection():
+    """Отвязать фоновую задачу от соединения апдейта, в котором её создали"""
+    _update_conn.set(None)
+
+
+async def db_connection_middleware(handler, event, data):
+    """Outer-middleware диспетчера: одно лениво взятое соединение на апдейт"""
+    # Семья из кэша сразу попадает в контекст логов, иначе - при первом запросе
+    user = data.get("event_from_user")
+    if user and user.id in _member_family:
+        bind_member(user.id, _member_family[user.id])
+    holder = UpdateConnection()
+    token = _update_conn.set(holder)
+    data["db"] = holder
+    failed = False
+    try:
+        return await handler(event, data)
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _update_conn.reset(token)
+        await holder.release(failed)
+
+
+@asynccontextmanager
+async def read_connection():
+    """Соединение для чтения: с реплики, если она есть и жива, иначе с основной базы
+    
+    Только для чтений, которым не важно отставание реплики (история, дайджест,
+    статистика). Сразу после записи читаем через connection().
+    """
+    global _replica_pool, _replica_down_until
+    
+    if DATABASE_REPLICA_URL and time.monotonic() >= _replica_down_until:
+        conn = None
+        try:
+            if _replica_pool is None:
+                _replica_pool = await asyncpg.create_pool(DATABASE_REPLICA_URL, min_size=1, init=tracing.instrument_connection)
+            conn = await _replica_pool.acquire(timeout=REPLICA_ACQUIRE_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+            metrics.inc("db_replica_fallbacks_total")
+            logger.warning("Replica unavailable, falling back to primary: %s", e)
+        
+        if conn is not None:
+            metrics.inc("db_reads_total", target="replica")
+            try:
+                yield conn
+            finally:
+                await _replica_pool.release(conn)
+            return
+    
+    metrics.inc("db_reads_total", target="primary")
+    async with connection() as conn:
+        yield conn
+
+
+metrics.register_gauge(
+    "db_replica_available",
+    lambda: int(_replica_pool is not None and time.monotonic() >= _replica_down_until)
+)
+
+
+# Последняя известная семья пользователя: для маршрутизации меню и лимитов,
+# где не нужна точность до последней записи
+_member_family = {}
+MAX_CACHED_MEMBERS = 10000
+
+
+def cached_family_id(user_id: int):
+    """Семья пользователя из кэша, без обращения к базе (None - неизвестна)"""
+    return _member_family.get(user_id)
+
+
+def forget_member(user_id: int):
+    """Забыть семью пользователя (после вступления или удаления)"""
+    _member_family.pop(user_id, None)
+
+
+def forget_all_members():
+    """Забыть семьи всех пользователей (кэш мог устареть)"""
+    _member_family.clear()
+
+
+def _remember_member(user_id: int, family_id: int):
+    if len(_member_family) >= MAX_CACHED_MEMBERS:
+        _member_family.clear()
+    _member_family[user_id] = family_id
+    bind_member(user_id, family_id)
+
+
 async def ensure_family(user_id: int) -> int:
     """Убедиться, что пользователь состоит в семье, если нет - создать новую"""
-    async with _pool.acquire() as conn:
+    async with connection() as conn:
         # Проверяем, есть ли пользователь в какой-то семье
         row = await conn.fetchrow(
             "SELECT family_id FROM family_members WHERE user_id=$1",
@@ -214,6 +791,7 @@ async def ensure_family(user_id: int) -> int:
         )
         
         if row:
+            _remember_member(user_id, row['family_id'])
             return row['family_id']
         
         # Создаем новую семью
@@ -227,22 +805,27 @@ async def ensure_family(user_id: int) -> int:
             family_id, user_id
         )
         
+        _remember_member(user_id, family_id)
         return family_id
 
 
 async def get_family_id(user_id: int) -> int:
     """Получить ID семьи пользователя"""
-    async with _pool.acquire() as conn:
+    async with connection() as conn:
         row = await conn.fetchrow(
             "SELECT family_id FROM family_members WHERE user_id=$1",
             user_id
         )
-        return row['family_id'] if row else None
+        if not row:
+            forget_member(user_id)
+            return None
+        _remember_member(user_id, row['family_id'])
+        return row['family_id']
 
 
 async def is_parent(user_id: int) -> bool:
     """Проверить, является ли пользователь родителем"""
-    async with _pool.acquire() as conn:
+    async with connection() as conn:
         row = await conn.fetchrow(
             "SELECT role FROM family_members WHERE user_id=$1",
             user_id
@@ -252,7 +835,7 @@ async def is_parent(user_id: int) -> bool:
 
 async def get_family_settings(family_id: int) -> dict:
     """Получить настройки семьи (название и эмодзи)"""
-    async with _pool.acquire() as conn:
+    async with connection() as conn:
         row = await conn.fetchrow(
             """SELECT name, emoji_task, emoji_shopping, emoji_family, emoji_history, emoji_add
                FROM families WHERE id=$1""",
@@ -275,7 +858,7 @@ async def log_activity(family_id: int, user_id: int, action: str, action_type: s
     
     action_type может быть: 'task', 'shopping', 'role', 'remove', 'rename', 'join', 'other'
     """
-    async with _pool.acquire() as conn:
+    async with connection() as conn:
         await conn.execute(
             "INSERT INTO activity_log (family_id, user_id, action, action_type) VALUES ($1, $2, $3, $4)",
             family_id, user_id, action, action_type
@@ -283,7 +866,12 @@ async def log_activity(family_id: int, user_id: int, action: str, action_type: s
 
 
 async def close_db():
-    """Закрыть пул соединений"""
-    global _pool
+    """Закрыть пул соединений (и после неудачной попытки запуска)"""
+    global _pool, _replica_pool
+    db_ready.clear()
+    if _replica_pool:
+        await _replica_pool.close()
+        _replica_pool = None
     if _pool:
         await _pool.close()
+        _pool = None
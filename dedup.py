@@ -0,0 +1,101 @@
+"""
+Подавление повторных доставок одного update_id (ретраи webhook)
+"""
+import logging
+from collections import OrderedDict
+from aiogram.types import Update
+from config import DEDUP_SHARED
+from db import connection, db_available, detach_update_connection, DatabaseUnavailable, TRANSIENT_ERRORS
+from log import sampled
+import metrics
+import drain
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних update_id помним в памяти
+MAX_SEEN = 10000
+
+# Раз в сколько вставок чистить общую таблицу и сколько хранить записи
+CLEANUP_EVERY = 1000
+KEEP_INTERVAL = '1 day'
+
+_seen = OrderedDict()
+_inserts = 0
+
+
+def _remember(update_id: int) -> bool:
+    """Запомнить update_id; False - уже видели"""
+    if update_id in _seen:
+        _seen.move_to_end(update_id)
+        return False
+    _seen[update_id] = True
+    if len(_seen) > MAX_SEEN:
+        _seen.popitem(last=False)
+    return True
+
+
+async def _cleanup():
+    async with connection() as conn:
+        await conn.execute(
+            f"DELETE FROM processed_updates WHERE seen_at < NOW() - INTERVAL '{KEEP_INTERVAL}'"
+        )
+
+
+async def _claim_shared(update_id: int) -> bool:
+    """Отметить update_id в общей для реплик таблице; False - уже обработан"""
+    global _inserts
+    async with connection() as conn:
+        claimed = await conn.fetchval(
+            """INSERT INTO processed_updates (update_id) VALUES ($1)
+               ON CONFLICT DO NOTHING RETURNING update_id""",
+            update_id
+        )
+
+    _inserts += 1
+    if _inserts % CLEANUP_EVERY == 0:
+        drain.spawn(_cleanup())
+    return claimed is not None
+
+
+async def _release_shared(update_id: int):
+    # Не общее соединение апдейта: его транзакцию после ошибки откатят,
+    # а вместе с ней и это удаление
+    detach_update_connection()
+    async with connection() as conn:
+        await conn.execute("DELETE FROM processed_updates WHERE update_id=$1", update_id)
+
+
+async def dedup_middleware(handler, event: Update, data):
+    """Outer-middleware апдейтов: повтор уже принятого update_id не обрабатываем
+
+    Если обработка упала из-за недоступной базы, update_id забывается, чтобы
+    ретрай Telegram прошёл. После остальных ошибок часть записей и сообщений
+    могла уже уйти, и повтор их бы задвоил - такой update_id остаётся занятым.
+    """
+    update_id = event.update_id
+
+    if not _remember(update_id):
+        metrics.inc("updates_suppressed_total", layer="memory")
+        return None
+
+    if DEDUP_SHARED:
+        try:
+            claimed = await _claim_shared(update_id)
+        except DatabaseUnavailable:
+            # Без базы остаётся только память этой реплики: лучше, чем не ответить
+            claimed = True
+            sampled(logger, "dedup_unavailable", 100, "Shared dedup skipped: database unavailable")
+        if not claimed:
+            metrics.inc("updates_suppressed_total", layer="postgres")
+            return None
+
+    try:
+        return await handler(event, data)
+    except TRANSIENT_ERRORS:
+        _seen.pop(update_id, None)
+        if DEDUP_SHARED and db_available():
+            try:
+                await _release_shared(update_id)
+            except Exception as e:
+                logger.warning("Failed to release update: %s", e, extra={"released_update_id": update_id})
+        raise
@@ -0,0 +1,84 @@
+"""
+Плавная остановка: дождаться текущих апдейтов и фоновых задач перед выходом
+"""
+import asyncio
+import logging
+import time
+from db import detach_update_connection
+
+logger = logging.getLogger(__name__)
+
+_draining = False
+_in_flight = 0
+_idle = asyncio.Event()
+_idle.set()
+_background = set()
+
+
+def is_draining() -> bool:
+    return _draining
+
+
+async def _detached(coro):
+    # Задача наследует контекст апдейта, но не должна делить его соединение
+    detach_update_connection()
+    return await coro
+
+
+def spawn(coro) -> asyncio.Task:
+    """Запустить фоновую задачу, которую остановка дождётся"""
+    task = asyncio.create_task(_detached(coro))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def track_update(handler, event, data):
+    """Outer-middleware диспетчера: считает апдейты в обработке"""
+    global _in_flight
+    _in_flight += 1
+    _idle.clear()
+    try:
+        return await handler(event, data)
+    finally:
+        _in_flight -= 1
+        if _in_flight == 0:
+            _idle.set()
+
+
+def reject_when_draining(webhook_path: str):
+    """aiohttp-middleware: во время остановки отвечаем 503 на webhook
+    
+    Telegram повторит такой апдейт, и его получит новая реплика.
+    """
+    from aiohttp import web
+
+    @web.middleware
+    async def middleware(request, handler):
+        if _draining and request.path == webhook_path:
+            return web.Response(status=503, text="draining")
+        return await handler(request)
+
+    return middleware
+
+
+async def drain(timeout: float):
+    """Перестать принимать апдейты и дождаться текущей работы (не дольше timeout)"""
+    global _draining
+    _draining = True
+    started = time.perf_counter()
+    logger.info("Draining", extra={"in_flight": _in_flight, "background": len(_background)})
+    
+    try:
+        await asyncio.wait_for(_idle.wait(), timeout)
+        remaining = timeout - (time.perf_counter() - started)
+        if _background:
+            done, pending = await asyncio.wait(set(_background), timeout=max(remaining, 0))
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning("Drain deadline reached, cancelled background tasks", extra={"cancelled": len(pending)})
+    except asyncio.TimeoutError:
+        logger.warning("Drain deadline reached with updates in flight", extra={"in_flight": _in_flight})
+    
+    logger.info("Drained", extra={"duration_ms": round((time.perf_counter() - started) * 1000)})
@@ -0,0 +1,129 @@
+"""
+FSM-хранилище в памяти с ограниченным временем жизни и размером
+
+MemoryStorage держит состояние каждого, кто начал добавление, переименование
+или смену эмодзи и не закончил, до перезапуска процесса, а чтение состояния
+у defaultdict само создаёт пустую запись. Здесь записи живут FSM_TTL секунд
+с последнего обращения, их не больше FSM_MAX_ENTRIES (лишние вытесняются по
+LRU), пустые удаляются сразу, просроченные раз в FSM_SWEEP_INTERVAL.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from copy import copy
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.types import CallbackQuery
+from config import FSM_TTL, FSM_MAX_ENTRIES
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять просроченные записи
+FSM_SWEEP_INTERVAL = 60
+
+SESSION_EXPIRED_TEXT = "Сессия устарела, начните заново"
+
+
+class BoundedMemoryStorage(MemoryStorage):
+    """MemoryStorage с TTL на ключ, общим лимитом записей и LRU-вытеснением"""
+
+    def __init__(self, ttl: float = FSM_TTL, max_entries: int = FSM_MAX_ENTRIES):
+        super().__init__()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Ключ -> (запись, время последнего обращения); порядок - от давних к свежим
+        self.storage = OrderedDict()
+
+    def _get(self, key: StorageKey):
+        """Живая запись ключа или None; обращение продлевает её срок"""
+        entry = self.storage.get(key)
+        if entry is None:
+            return None
+        record, touched = entry
+        now = time.monotonic()
+        if now - touched > self.ttl:
+            del self.storage[key]
+            metrics.inc("fsm_evictions_total", reason="ttl")
+            return None
+        self.storage[key] = (record, now)
+        self.storage.move_to_end(key)
+        return record
+
+    def _put(self, key: StorageKey, record: MemoryStorageRecord):
+        # Завершённый сценарий (state.clear()) память не занимает
+        if record.state is None and not record.data:
+            self.storage.pop(key, None)
+            return
+        self.storage[key] = (record, time.monotonic())
+        self.storage.move_to_end(key)
+        while len(self.storage) > self.max_entries:
+            self.storage.popitem(last=False)
+            metrics.inc("fsm_evictions_total", reason="lru")
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        record = self._get(key) or MemoryStorageRecord()
+        record.state = state.state if isinstance(state, State) else state
+        self._put(key, record)
+
+    async def get_state(self, key: StorageKey):
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        record = self._get(key) or MemoryStorageRecord()
+        record.data = data.copy()
+        self._put(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        record = self._get(key)
+        return record.data.copy() if record else {}
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default=None):
+        record = self._get(storage_key)
+        if record is None:
+            return default
+        return copy(record.data.get(dict_key, default))
+
+    def sweep(self) -> int:
+        """Удалить просроченные записи; сколько удалено
+
+        Записи упорядочены по последнему обращению, так что просроченные
+        лежат в начале и проход останавливается на первой живой.
+        """
+        deadline = time.monotonic() - self.ttl
+        removed = 0
+        while self.storage:
+            key, (_, touched) = next(iter(self.storage.items()))
+            if touched > deadline:
+                break
+            del self.storage[key]
+            removed += 1
+        if removed:
+            metrics.inc("fsm_evictions_total", removed, reason="ttl")
+        return removed
+
+
+async def session_expired(event, state):
+    """Ответ, когда данные диалога уже вытеснены, а его кнопки ещё в чате"""
+    await state.clear()
+    metrics.inc("fsm_sessions_expired_total")
+    if isinstance(event, CallbackQuery):
+        return event.answer(SESSION_EXPIRED_TEXT, show_alert=True)
+    return event.answer(SESSION_EXPIRED_TEXT)
+
+
+async def schedule_sweep(storage: BoundedMemoryStorage):
+    """Периодически удалять просроченные FSM-записи"""
+    while True:
+        await asyncio.sleep(FSM_SWEEP_INTERVAL)
+        removed = storage.sweep()
+        if removed:
+            logger.info("Expired FSM entries removed", extra={"removed": removed, "live": len(storage.storage)})
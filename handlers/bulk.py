@@ -0,0 +1,163 @@
+import logging
+from aiogram import Router
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from db import get_family_id, connection, log_activity, bot
+from suggestions import record_purchase
+from invalidation import publish
+from callbacks import Bulk, BulkToggle, BulkDone, BulkCancel, Route, parse
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+# Тип -> (таблица, заголовок выбора, запись в историю, уведомление создателю)
+BULK_TABLES = {
+    'task': ('tasks', "📋 Отметьте выполненные задачи:", "Выполнил задачи", "✅ Задачи выполнены!"),
+    'shopping': ('shopping', "🛒 Отметьте купленное:", "Купил", "✅ Покупки выполнены!")
+}
+
+SELECTED = "✅"
+UNSELECTED = "☐"
+
+# В клавиатуре не больше 100 кнопок: записи плюс три кнопки управления
+MAX_SELECTION = 97
+
+
+def bulk_button(kind: str):
+    """Кнопка под списком, включающая режим выбора"""
+    return InlineKeyboardButton(text="☑️ Отметить несколько", callback_data=Bulk(kind=kind).pack())
+
+
+def selection_keyboard(kind: str, rows: list) -> InlineKeyboardMarkup:
+    """Клавиатура выбора: (id, текст, выбрано) на строку"""
+    buttons = [
+        [InlineKeyboardButton(
+            text=f"{SELECTED if selected else UNSELECTED} {text if len(text) <= 25 else text[:22] + '...'}",
+            callback_data=BulkToggle(kind=kind, id=item_id).pack()
+        )]
+        for item_id, text, selected in rows
+    ]
+    buttons.append([
+        InlineKeyboardButton(text="✅ Выполнить выбранные", callback_data=BulkDone(kind=kind, scope="selected").pack()),
+        InlineKeyboardButton(text="✔️ Все", callback_data=BulkDone(kind=kind, scope="all").pack())
+    ])
+    buttons.append([InlineKeyboardButton(text="↩️ Отмена", callback_data=BulkCancel().pack())])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def selection_rows(markup: InlineKeyboardMarkup) -> list:
+    """Прочитать выбор из клавиатуры сообщения: он хранится прямо в кнопках"""
+    rows = []
+    for row in markup.inline_keyboard if markup else []:
+        button = row[0]
+        payload = parse(button.callback_data or "")
+        if not isinstance(payload, BulkToggle):
+            continue
+        marker, _, text = button.text.partition(" ")
+        rows.append((payload.id, text, marker == SELECTED))
+    return rows
+
+
+@router.callback_query(Route(Bulk))
+async def start_selection(callback: CallbackQuery, callback_data: Bulk):
+    kind = callback_data.kind
+    table, title, _, _ = BULK_TABLES[kind]
+    family_id = await get_family_id(callback.from_user.id)
+
+    async with connection() as conn:
+        rows = await conn.fetch(
+            f"""SELECT id, text, COUNT(*) OVER () AS total FROM {table}
+                WHERE family_id=$1 AND completed=false
+                ORDER BY created_at LIMIT $2""",
+            family_id, MAX_SELECTION
+        )
+
+    if not rows:
+        return callback.answer("Список пуст", show_alert=True)
+
+    # Остальные можно отметить следующим заходом, когда эти будут выполнены
+    total = rows[0]['total']
+    if total > len(rows):
+        title += f"\n\nПоказаны первые {len(rows)} из {total}."
+
+    await callback.answer()
+    return callback.message.edit_text(
+        title,
+        reply_markup=selection_keyboard(kind, [(r['id'], r['text'], False) for r in rows])
+    )
+
+
+@router.callback_query(Route(BulkToggle))
+async def toggle_selection(callback: CallbackQuery, callback_data: BulkToggle):
+    kind = callback_data.kind
+    item_id = callback_data.id
+
+    rows = [
+        (row_id, text, not selected if row_id == item_id else selected)
+        for row_id, text, selected in selection_rows(callback.message.reply_markup)
+    ]
+
+    await callback.answer()
+    return callback.message.edit_reply_markup(reply_markup=selection_keyboard(kind, rows))
+
+
+@router.callback_query(Route(BulkCancel))
+async def cancel_selection(callback: CallbackQuery):
+    await callback.message.delete()
+    return callback.answer("Отменено")
+
+
+@router.callback_query(Route(BulkDone), flags={"throttle": "expensive"})
+async def complete_selected(callback: CallbackQuery, callback_data: BulkDone):
+    kind = callback_data.kind
+    table, _, action, notice = BULK_TABLES[kind]
+
+    # "Все" - это все записи, показанные в выборе, а не добавленные после
+    rows = selection_rows(callback.message.reply_markup)
+    item_ids = [row_id for row_id, _, selected in rows if selected or callback_data.scope == "all"]
+    if not item_ids:
+        return callback.answer("Ничего не выбрано", show_alert=True)
+
+    family_id = await get_family_id(callback.from_user.id)
+
+    try:
+        executor_chat = await bot.get_chat(callback.from_user.id)
+        executor_name = executor_chat.first_name
+    except:
+        executor_name = "Кто-то"
+
+    async with connection() as conn:
+        done = await conn.fetch(
+            f"""UPDATE {table} SET completed=true, completed_at=NOW(), completed_by=$3
+                WHERE id = ANY($1::int[]) AND family_id=$2 AND completed=false
+                RETURNING text, created_by""",
+            item_ids, family_id, callback.from_user.id
+        )
+
+    if not done:
+        await callback.message.delete()
+        return callback.answer("Уже выполнено")
+
+    # Одна запись в истории на всю пачку
+    await log_activity(family_id, callback.from_user.id, f"{action} ({len(done)}): " + ", ".join(r['text'] for r in done), kind)
+
+    if kind == 'shopping':
+        for r in done:
+            record_purchase(family_id, r['text'])
+    await publish("items", family_id)
+
+    # Одно уведомление на создателя со всеми его записями
+    by_creator = {}
+    for r in done:
+        if r['created_by'] and r['created_by'] != callback.from_user.id:
+            by_creator.setdefault(r['created_by'], []).append(r['text'])
+
+    for creator_id, texts in by_creator.items():
+        items = "\n".join(f"• {text}" for text in texts)
+        try:
+            await bot.send_message(creator_id, f"{notice}\n\n{items}\n\n👤 Выполнил: {executor_name}")
+        except Exception as e:
+            logger.warning("Failed to send completion notification: %s", e, extra={"recipient": creator_id})
+
+    await callback.message.delete()
+    return callback.answer(f"Выполнено: {len(done)} ✅")
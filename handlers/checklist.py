@@ -0,0 +1,201 @@
+from aiogram import Router
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.fsm.context import FSMContext
+from states.user_states import UserState
+from db import get_family_id, connection
+from callbacks import Checklist, CheckToggle, CheckUp, CheckAdd, Route
+from fsm_storage import session_expired
+
+router = Router()
+
+# Тип -> (таблица чек-листа, колонка родителя, таблица родителя)
+CHECKLIST_TABLES = {
+    'task': ('task_checklist', 'task_id', 'tasks'),
+    'shopping': ('shopping_checklist', 'shopping_id', 'shopping')
+}
+
+
+async def load_checklists(conn, kind: str, parent_ids: list) -> dict:
+    """Загрузить чек-листы для всех записей страницы одним запросом"""
+    table, fk, _ = CHECKLIST_TABLES[kind]
+    rows = await conn.fetch(
+        f"""SELECT id, {fk} AS parent_id, text, completed
+            FROM {table}
+            WHERE {fk} = ANY($1::int[])
+            ORDER BY {fk}, position, id""",
+        parent_ids
+    )
+
+    checklists = {}
+    for r in rows:
+        checklists.setdefault(r['parent_id'], []).append(r)
+    return checklists
+
+
+def format_checklist(items: list, indent: str = "   ") -> str:
+    """Строки чек-листа для вывода под задачей или покупкой"""
+    return "".join(
+        f"{indent}{'☑' if item['completed'] else '☐'} {item['text']}\n"
+        for item in items
+    )
+
+
+async def render_checklist(conn, kind: str, parent_id: int, family_id: int):
+    """Текст и клавиатура чек-листа; None, если запись не из этой семьи"""
+    parent_table = CHECKLIST_TABLES[kind][2]
+    parent = await conn.fetchrow(
+        f"SELECT text FROM {parent_table} WHERE id=$1 AND family_id=$2",
+        parent_id, family_id
+    )
+    if not parent:
+        return None
+
+    items = (await load_checklists(conn, kind, [parent_id])).get(parent_id, [])
+    done = sum(1 for item in items if item['completed'])
+
+    text = f"☑️ Чек-лист ({done}/{len(items)}):\n«{parent['text']}»\n\n"
+    if not items:
+        text += "Пунктов пока нет"
+
+    buttons = []
+    for item in items:
+        item_text = item['text'] if len(item['text']) <= 25 else item['text'][:22] + "..."
+        buttons.append([
+            InlineKeyboardButton(
+                text=f"{'✅' if item['completed'] else '☐'} {item_text}",
+                callback_data=CheckToggle(kind=kind, id=item['id']).pack()
+            ),
+            InlineKeyboardButton(text="⬆", callback_data=CheckUp(kind=kind, id=item['id']).pack())
+        ])
+
+    buttons.append([InlineKeyboardButton(text="➕ Пункт", callback_data=CheckAdd(kind=kind, parent_id=parent_id).pack())])
+
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+async def item_parent(conn, kind: str, item_id: int, family_id: int):
+    """ID родительской записи пункта, если пункт принадлежит семье"""
+    table, fk, parent_table = CHECKLIST_TABLES[kind]
+    return await conn.fetchval(
+        f"""SELECT c.{fk} FROM {table} c
+            JOIN {parent_table} p ON p.id = c.{fk}
+            WHERE c.id=$1 AND p.family_id=$2""",
+        item_id, family_id
+    )
+
+
+@router.callback_query(Route(Checklist))
+async def show_checklist(callback: CallbackQuery, callback_data: Checklist):
+    kind = callback_data.kind
+    parent_id = callback_data.id
+    family_id = await get_family_id(callback.from_user.id)
+
+    async with connection() as conn:
+        rendered = await render_checklist(conn, kind, parent_id, family_id)
+
+    if not rendered:
+        return callback.answer("Запись не найдена", show_alert=True)
+
+    text, keyboard = rendered
+    await callback.answer()
+    return callback.message.answer(text, reply_markup=keyboard)
+
+
+@router.callback_query(Route(CheckToggle))
+async def toggle_item(callback: CallbackQuery, callback_data: CheckToggle):
+    kind = callback_data.kind
+    item_id = callback_data.id
+    table = CHECKLIST_TABLES[kind][0]
+    family_id = await get_family_id(callback.from_user.id)
+
+    async with connection() as conn:
+        parent_id = await item_parent(conn, kind, item_id, family_id)
+        if not parent_id:
+            return callback.answer("Пункт не найден", show_alert=True)
+
+        await conn.execute(
+            f"UPDATE {table} SET completed = NOT completed WHERE id=$1",
+            item_id
+        )
+        text, keyboard = await render_checklist(conn, kind, parent_id, family_id)
+
+    await callback.answer()
+    return callback.message.edit_text(text, reply_markup=keyboard)
+
+
+@router.callback_query(Route(CheckUp))
+async def move_item_up(callback: CallbackQuery, callback_data: CheckUp):
+    kind = callback_data.kind
+    item_id = callback_data.id
+    table, fk, _ = CHECKLIST_TABLES[kind]
+    family_id = await get_family_id(callback.from_user.id)
+
+    async with connection() as conn:
+        parent_id = await item_parent(conn, kind, item_id, family_id)
+        if not parent_id:
+            return callback.answer("Пункт не найден", show_alert=True)
+
+        ids = [r['id'] for r in await conn.fetch(
+            f"SELECT id FROM {table} WHERE {fk}=$1 ORDER BY position, id",
+            parent_id
+        )]
+
+        index = ids.index(item_id)
+        if index == 0:
+            return callback.answer("Пункт уже первый")
+        ids[index - 1], ids[index] = ids[index], ids[index - 1]
+
+        # Перенумеровываем весь список одним UPDATE
+        await conn.execute(
+            f"""UPDATE {table} c SET position = u.position
+                FROM unnest($1::int[], $2::int[]) AS u(id, position)
+                WHERE c.id = u.id""",
+            ids, list(range(len(ids)))
+        )
+        text, keyboard = await render_checklist(conn, kind, parent_id, family_id)
+
+    await callback.answer()
+    return callback.message.edit_text(text, reply_markup=keyboard)
+
+
+@router.callback_query(Route(CheckAdd))
+async def add_item_start(callback: CallbackQuery, callback_data: CheckAdd, state: FSMContext):
+    await state.set_state(UserState.add_checklist_item)
+    await state.update_data(checklist_kind=callback_data.kind, checklist_parent=callback_data.parent_id)
+    await callback.answer()
+    return callback.message.answer("Введите пункты чек-листа (каждый с новой строки):")
+
+
+@router.message(UserState.add_checklist_item)
+async def add_item_finish(message: Message, state: FSMContext):
+    if not message.text:
+        return message.answer("Отправьте пункты текстом, каждый с новой строки:")
+
+    data = await state.get_data()
+    kind = data.get("checklist_kind")
+    parent_id = data.get("checklist_parent")
+    if kind is None or parent_id is None:
+        return await session_expired(message, state)
+    table, fk, _ = CHECKLIST_TABLES[kind]
+    family_id = await get_family_id(message.from_user.id)
+
+    items = [line.strip() for line in message.text.splitlines() if line.strip()]
+
+    async with connection() as conn:
+        rendered = await render_checklist(conn, kind, parent_id, family_id)
+        if not rendered:
+            await state.clear()
+            return message.answer("❌ Запись не найдена")
+
+        # Все пункты добавляем одним INSERT в конец списка
+        await conn.execute(
+            f"""INSERT INTO {table} ({fk}, text, position)
+                SELECT $1, u.text,
+                       (SELECT COALESCE(MAX(position) + 1, 0) FROM {table} WHERE {fk}=$1) + u.n - 1
+                FROM unnest($2::text[]) WITH ORDINALITY AS u(text, n)""",
+            parent_id, items
+        )
+        text, keyboard = await render_checklist(conn, kind, parent_id, family_id)
+
+    await state.clear()
+    return message.answer(text, reply_markup=keyboard)
@@ -0,0 +1,128 @@
+import asyncio
+import gzip
+import logging
+import os
+import tempfile
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, FSInputFile
+from db import bot, get_family_id, read_connection, is_parent
+import drain
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+# Сколько секунд может идти один COPY: выгрузка длиннее обычного запроса
+EXPORT_TIMEOUT = 600
+
+# Сколько байт COPY копим, прежде чем сжать их в отдельном потоке
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Что выгружаем: имя файла -> запрос по семье
+EXPORT_QUERIES = {
+    'history': """
+        SELECT created_at, user_id, action_type, action
+        FROM activity_log WHERE family_id=$1 ORDER BY created_at
+    """,
+    'tasks': """
+        SELECT id, text, completed, created_at, completed_at, assigned_to, created_by
+        FROM tasks_all WHERE family_id=$1 ORDER BY created_at
+    """,
+    'shopping': """
+        SELECT id, text, completed, created_at, completed_at, assigned_to, created_by
+        FROM shopping_all WHERE family_id=$1 ORDER BY created_at
+    """
+}
+
+
+async def copy_to_gzip(conn, query: str, family_id: int, fmt: str, path: str):
+    """Потоково выгрузить результат запроса через COPY в gzip-файл
+
+    Строки не собираются в памяти целиком: чанки COPY копятся до
+    WRITE_BUFFER_SIZE и сжимаются на диск в отдельном потоке, чтобы
+    большая выгрузка не держала event loop.
+    """
+    gz = await asyncio.to_thread(gzip.open, path, 'wb')
+    buffer = []
+    buffered = 0
+
+    async def flush():
+        nonlocal buffer, buffered
+        if buffer:
+            data, buffer, buffered = b"".join(buffer), [], 0
+            await asyncio.to_thread(gz.write, data)
+
+    async def write(chunk):
+        nonlocal buffered
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= WRITE_BUFFER_SIZE:
+            await flush()
+
+    try:
+        if fmt == 'json':
+            # JSON Lines: одна колонка row_to_json; \x01/\x02 не встречаются
+            # в JSON, так что CSV-экранирование ничего не меняет
+            await conn.copy_from_query(
+                f"SELECT row_to_json(t) FROM ({query}) t",
+                family_id,
+                output=write, format='csv', quote='\x01', delimiter='\x02',
+                timeout=EXPORT_TIMEOUT
+            )
+        else:
+            await conn.copy_from_query(
+                query, family_id,
+                output=write, format='csv', header=True,
+                timeout=EXPORT_TIMEOUT
+            )
+        await flush()
+    finally:
+        await asyncio.to_thread(gz.close)
+
+
+async def run_export(chat_id: int, family_id: int, fmt: str):
+    """Собрать выгрузку и отправить её документами"""
+    ext = 'jsonl' if fmt == 'json' else 'csv'
+    paths = []
+
+    try:
+        async with read_connection() as conn:
+            # Один снимок данных на все таблицы
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                # Обычный statement_timeout рассчитан на запросы хендлеров
+                await conn.execute("SET LOCAL statement_timeout = 0")
+                for name, query in EXPORT_QUERIES.items():
+                    fd, path = tempfile.mkstemp(suffix=f".{ext}.gz")
+                    os.close(fd)
+                    paths.append((name, path))
+                    await copy_to_gzip(conn, query, family_id, fmt, path)
+
+        for name, path in paths:
+            await bot.send_document(chat_id, FSInputFile(path, filename=f"{name}.{ext}.gz"))
+        await bot.send_message(chat_id, "✅ Выгрузка готова")
+    except Exception as e:
+        logger.exception("Export failed", extra={"family_id": family_id})
+        await bot.send_message(chat_id, f"❌ Ошибка при выгрузке: {str(e)}")
+    finally:
+        for _, path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+@router.message(Command("export"), flags={"throttle": "expensive"})
+async def export_command(message: Message, command: CommandObject):
+    if not await is_parent(message.from_user.id):
+        return message.answer("Только родитель может выгружать данные.")
+
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in ('csv', 'json'):
+        return message.answer("📦 Использование: /export [csv|json]")
+
+    family_id = await get_family_id(message.from_user.id)
+
+    # Выгрузка идёт в фоне, webhook отвечает сразу
+    drain.spawn(run_export(message.chat.id, family_id, fmt))
+    return message.answer("⏳ Готовлю выгрузку истории, задач и покупок...")
@@ -1,17 +1,23 @@
-from aiogram import Router, F
+import logging
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from states.user_states import UserState
-from db import bot, get_family_id, get_pool, is_parent, log_activity
+from db import bot, get_family_id, connection, is_parent, log_activity, begin_update_transaction
+from menu import MenuButton
+from callbacks import ChangeRole, RemoveMember, Route
+from invalidation import invalidate
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
-@router.message(F.text == "👨‍👩‍👧‍👦 Семья")
+@router.message(MenuButton("family"), flags={"throttle": "expensive"})
 async def show_family(message: Message):
     family_id = await get_family_id(message.from_user.id)
     parent = await is_parent(message.from_user.id)
 
-    async with get_pool().acquire() as conn:
+    async with connection() as conn:
         family = await conn.fetchrow(
             "SELECT name FROM families WHERE id=$1",
             family_id
@@ -44,35 +50,35 @@ async def show_family(message: Message):
             buttons.append([
                 InlineKeyboardButton(
                     text=f"{role_emoji} Изменить роль: {name}",
-                    callback_data=f"change_role:{r['user_id']}:{new_role}"
+                    callback_data=ChangeRole(user_id=r['user_id'], role=new_role).pack()
                 ),
                 InlineKeyboardButton(
                     text=f"❌ Удалить: {name}",
-                    callback_data=f"remove_member:{r['user_id']}"
+                    callback_data=RemoveMember(user_id=r['user_id']).pack()
                 )
             ])
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
-    await message.answer(text, reply_markup=keyboard)
+    return message.answer(text, reply_markup=keyboard)
 
-@router.callback_query(F.data.startswith("change_role:"))
-async def change_role(callback: CallbackQuery):
+@router.callback_query(Route(ChangeRole), flags={"throttle": "expensive"})
+async def change_role(callback: CallbackQuery, callback_data: ChangeRole):
     if not await is_parent(callback.from_user.id):
-        await callback.answer("Только родитель может изменять роли", show_alert=True)
-        return
+        return callback.answer("Только родитель может изменять роли", show_alert=True)
     
-    parts = callback.data.split(":")
-    target_user_id = int(parts[1])
-    new_role = parts[2]
+    target_user_id = callback_data.user_id
+    new_role = callback_data.role
     
     family_id = await get_family_id(callback.from_user.id)
     
-    async with get_pool().acquire() as conn:
+    async with connection() as conn:
         await conn.execute(
             "UPDATE family_members SET role=$1 WHERE user_id=$2 AND family_id=$3",
             new_role, target_user_id, family_id
         )
     
+    await invalidate("member", target_user_id)
+    
     try:
         chat = await bot.get_chat(target_user_id)
         name = chat.first_name
@@ -86,15 +92,14 @@ async def change_role(callback: CallbackQuery):
     await callback.answer(f"✅ Роль изменена на {role_name}")
     
     # Показываем обновлённый список
-    await show_family(callback.message)
+    return await show_family(callback.message)
 
-@router.callback_query(F.data.startswith("remove_member:"))
-async def remove_member(callback: CallbackQuery):
+@router.callback_query(Route(RemoveMember), flags={"throttle": "expensive"})
+async def remove_member(callback: CallbackQuery, callback_data: RemoveMember):
     if not await is_parent(callback.from_user.id):
-        await callback.answer("Только родитель может удалять участников", show_alert=True)
-        return
+        return callback.answer("Только родитель может удалять участников", show_alert=True)
     
-    target_user_id = int(callback.data.split(":")[1])
+    target_user_id = callback_data.user_id
     family_id = await get_family_id(callback.from_user.id)
     
     # Получаем имя удаляемого пользователя
@@ -105,12 +110,13 @@ async def remove_member(callback: CallbackQuery):
         name = str(target_user_id)
     
     # Удаляем пользователя из семьи
-    async with get_pool().acquire() as conn:
+    async with connection() as conn:
         await conn.execute(
             "DELETE FROM family_members WHERE user_id=$1 AND family_id=$2",
             target_user_id, family_id
         )
     
+    await invalidate("member", target_user_id)
     await log_activity(family_id, callback.from_user.id, f"Удалил из семьи: {name}", 'remove')
     
     # Уведомляем удалённого пользователя
@@ -120,49 +126,50 @@ async def remove_member(callback: CallbackQuery):
             f"❌ Вы были удалены из семьи.\n\nВы можете создать новую семью, нажав /start"
         )
     except Exception as e:
-        print(f"Failed to notify removed user {target_user_id}: {e}")
+        logger.warning("Failed to notify removed user: %s", e, extra={"target_user_id": target_user_id})
     
     await callback.message.delete()
     await callback.answer(f"✅ {name} удалён из семьи")
     
     # Показываем обновлённый список
-    await show_family(callback.message)
+    return await show_family(callback.message)
 
-@router.message(F.text == "✏️ Название семьи")
+@router.message(MenuButton("rename"))
 async def rename_family_start(message: Message, state: FSMContext):
     if not await is_parent(message.from_user.id):
-        await message.answer("Только родитель может изменить название семьи.")
-        return
+        return message.answer("Только родитель может изменить название семьи.")
     
     await state.set_state(UserState.rename_family)
-    await message.answer("Введите новое название семьи:")
+    return message.answer("Введите новое название семьи:")
 
 @router.message(UserState.rename_family)
 async def rename_family_finish(message: Message, state: FSMContext):
     family_id = await get_family_id(message.from_user.id)
     new_name = message.text.strip()
     
-    async with get_pool().acquire() as conn:
+    # Переименование и запись в историю - атомарно
+    await begin_update_transaction()
+    async with connection() as conn:
         await conn.execute(
             "UPDATE families SET name=$1 WHERE id=$2",
             new_name, family_id
         )
     
     await log_activity(family_id, message.from_user.id, f"Изменил название семьи на: {new_name}", 'rename')
+    await invalidate("family", family_id)
     await state.clear()
-    await message.answer(f"✅ Название семьи изменено на: {new_name}")
+    return message.answer(f"✅ Название семьи изменено на: {new_name}")
 
-@router.message(F.text == "👨‍👩‍👧‍👦 Пригласить")
+@router.message(MenuButton("invite"))
 async def invite_member(message: Message):
     if not await is_parent(message.from_user.id):
-        await message.answer("Только родитель может приглашать участников.")
-        return
+        return message.answer("Только родитель может приглашать участников.")
     
     family_id = await get_family_id(message.from_user.id)
     
     invite_link = f"https://t.me/{(await bot.get_me()).username}?start=join_{family_id}"
     
-    await message.answer(
+    return message.answer(
         f"👨‍👩‍👧‍👦 Пригласительная ссылка:\n\n{invite_link}\n\n"
         "Отправьте эту ссылку члену семьи для присоединения."
     )
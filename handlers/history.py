@@ -1,7 +1,12 @@
-from aiogram import Router, F
+import logging
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery
 from keyboards.history import history_keyboard
-from db import bot, get_family_id, get_pool, is_parent
+from db import bot, get_family_id, read_connection, is_parent
+from menu import MenuButton
+from callbacks import HistoryPage, HistoryFilter, Route
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
@@ -18,19 +23,20 @@ ACTION_EMOJI = {
     'other': '📌'
 }
 
-@router.message(F.text == "📜 История")
+@router.message(MenuButton("history"), flags={"throttle": "expensive"})
 async def show_history(message: Message):
     if not await is_parent(message.from_user.id):
-        await message.answer("Только родитель может смотреть историю.")
-        return
+        return message.answer("Только родитель может смотреть историю.")
 
-    await send_history_page(message, 0, 'all')
+    return await send_history_page(message, 0, 'all')
 
-@router.callback_query(F.data.startswith("history:"))
-async def change_page(callback: CallbackQuery):
-    parts = callback.data.split(":")
-    filter_type = parts[1] if len(parts) > 2 else 'all'
-    page = int(parts[2]) if len(parts) > 2 else int(parts[1])
+@router.callback_query(Route(HistoryPage), flags={"throttle": "expensive"})
+async def change_page(callback: CallbackQuery, callback_data: HistoryPage):
+    if callback_data.page is None:
+        # Старая кнопка history:<page> - без фильтра
+        filter_type, page = 'all', int(callback_data.filter_type)
+    else:
+        filter_type, page = callback_data.filter_type, callback_data.page
     
     # Получаем данные для новой страницы
     family_id = await get_family_id(callback.from_user.id)
@@ -66,10 +72,10 @@ async def change_page(callback: CallbackQuery):
         """
         params = (family_id, filter_type, PAGE_SIZE, offset)
     
-    async with get_pool().acquire() as conn:
+    async with read_connection() as conn:
         rows = await conn.fetch(query, *params)
     
-    print(f"History filter: {filter_type}, page: {page}, rows found: {len(rows)}")
+    logger.debug("History page", extra={"filter": filter_type, "page": page, "rows": len(rows)})
     
     if not rows:
         filter_names = {
@@ -79,8 +85,7 @@ async def change_page(callback: CallbackQuery):
             'role': 'История изменений ролей',
             'admin': 'Админ-логи'
         }
-        await callback.answer(f"📜 {filter_names.get(filter_type, 'История')} пуста", show_alert=True)
-        return
+        return callback.answer(f"📜 {filter_names.get(filter_type, 'История')} пуста", show_alert=True)
     
     # Формируем текст с эмодзи типов
     filter_names = {
@@ -107,18 +112,13 @@ async def change_page(callback: CallbackQuery):
     keyboard = history_keyboard(page, len(rows) == PAGE_SIZE, filter_type)
     
     # Редактируем существующее сообщение вместо удаления
-    await callback.message.edit_text(text, reply_markup=keyboard)
     await callback.answer()
+    return callback.message.edit_text(text, reply_markup=keyboard)
 
-@router.callback_query(F.data.startswith("history_filter:"))
-async def filter_history(callback: CallbackQuery):
-    parts = callback.data.split(":")
-    filter_type = parts[1]
-    page = int(parts[2])
-    
+@router.callback_query(Route(HistoryFilter), flags={"throttle": "expensive"})
+async def filter_history(callback: CallbackQuery, callback_data: HistoryFilter):
     # Используем тот же обработчик, что и для навигации
-    callback.data = f"history:{filter_type}:{page}"
-    await change_page(callback)
+    return await change_page(callback, HistoryPage(filter_type=callback_data.filter_type, page=callback_data.page))
 
 async def send_history_page(message: Message, page: int, filter_type: str = 'all'):
     family_id = await get_family_id(message.from_user.id)
@@ -153,12 +153,11 @@ async def send_history_page(message: Message, page: int, filter_type: str = 'all
         """
         params = (family_id, filter_type, PAGE_SIZE, offset)
 
-    async with get_pool().acquire() as conn:
+    async with read_connection() as conn:
         rows = await conn.fetch(query, *params)
 
     if not rows:
-        await message.answer("📜 История пуста")
-        return
+        return message.answer("📜 История пуста")
 
     filter_names = {
         'all': 'Все',
@@ -183,4 +182,4 @@ async def send_history_page(message: Message, page: int, filter_type: str = 'all
 
     keyboard = history_keyboard(page, len(rows) == PAGE_SIZE, filter_type)
 
-    await message.answer(text, reply_markup=keyboard)
+    return message.answer(text, reply_markup=keyboard)
@@ -0,0 +1,105 @@
+from datetime import datetime
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from db import get_family_id, connection, log_activity
+from recurring import parse_schedule, next_run, scheduler
+from callbacks import RepeatDel, Route
+
+router = Router()
+
+KIND_WORDS = {
+    'задача': 'task',
+    'task': 'task',
+    'покупка': 'shopping',
+    'shopping': 'shopping'
+}
+
+USAGE = (
+    "🔁 Повторяющиеся задачи\n\n"
+    "Добавить: /repeat <расписание> | <текст> [| покупка]\n\n"
+    "Расписание:\n"
+    "• ежедневно 09:00\n"
+    "• вт 19:00 (пн, вт, ср, чт, пт, сб, вс)\n"
+    "• cron: 0 9 * * 1-5\n\n"
+    "Например: /repeat вт 19:00 | Вынести мусор"
+)
+
+
+async def send_templates(message: Message, user_id: int):
+    family_id = await get_family_id(user_id)
+
+    async with connection() as conn:
+        rows = await conn.fetch(
+            """SELECT id, kind, text, schedule, next_run_at FROM recurring_tasks
+               WHERE family_id=$1 AND active ORDER BY next_run_at""",
+            family_id
+        )
+
+    if not rows:
+        return message.answer(USAGE)
+
+    text = "🔁 Повторяющиеся задачи:\n\n"
+    buttons = []
+    for i, r in enumerate(rows, 1):
+        emoji = "📋" if r['kind'] == 'task' else "🛒"
+        text += f"{i}. {emoji} {r['text']}\n   ⏰ {r['schedule']}, далее {r['next_run_at'].strftime('%d.%m %H:%M')}\n"
+        button_text = r['text'] if len(r['text']) <= 25 else r['text'][:22] + "..."
+        buttons.append([InlineKeyboardButton(
+            text=f"❌ {button_text}",
+            callback_data=RepeatDel(id=r['id']).pack()
+        )])
+
+    text += "\n" + USAGE.split("\n\n", 1)[1]
+    return message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+
+@router.message(Command("repeat"))
+async def repeat_command(message: Message, command: CommandObject):
+    if not command.args:
+        return await send_templates(message, message.from_user.id)
+
+    parts = [p.strip() for p in command.args.split("|")]
+    if len(parts) < 2 or not parts[1]:
+        return message.answer(USAGE)
+
+    kind = KIND_WORDS.get(parts[2].lower(), 'task') if len(parts) > 2 else 'task'
+
+    try:
+        schedule = parse_schedule(parts[0])
+        run_at = next_run(schedule, datetime.now())
+    except ValueError as e:
+        return message.answer(f"❌ Не понял расписание: {e}\n\n{USAGE}")
+
+    family_id = await get_family_id(message.from_user.id)
+
+    async with connection() as conn:
+        template_id = await conn.fetchval(
+            """INSERT INTO recurring_tasks (family_id, kind, text, schedule, next_run_at, created_by)
+               VALUES ($1, $2, $3, $4, $5, $6) RETURNING id""",
+            family_id, kind, parts[1], schedule, run_at, message.from_user.id
+        )
+
+    scheduler.push(template_id, run_at, schedule)
+    await log_activity(family_id, message.from_user.id, f"Добавил повторяющуюся задачу: {parts[1]} ({schedule})", kind)
+    return message.answer(f"✅ Будет добавляться по расписанию «{schedule}»\n\nПервый раз: {run_at.strftime('%d.%m %H:%M')}")
+
+
+@router.callback_query(Route(RepeatDel))
+async def delete_template(callback: CallbackQuery, callback_data: RepeatDel):
+    template_id = callback_data.id
+    family_id = await get_family_id(callback.from_user.id)
+
+    async with connection() as conn:
+        text = await conn.fetchval(
+            "UPDATE recurring_tasks SET active=false WHERE id=$1 AND family_id=$2 RETURNING text",
+            template_id, family_id
+        )
+
+    if not text:
+        return callback.answer("Шаблон не найден", show_alert=True)
+
+    scheduler.forget(template_id)
+    await log_activity(family_id, callback.from_user.id, f"Удалил повторяющуюся задачу: {text}", 'other')
+    await callback.message.delete()
+    return callback.answer("✅ Повтор отключён")
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from aiogram import Router
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from db import get_family_id, connection, log_activity
+from callbacks import Due, DueSet, Route
+
+router = Router()
+
+# Тип -> таблица
+DUE_TABLES = {
+    'task': 'tasks',
+    'shopping': 'shopping'
+}
+
+# Варианты срока: код -> название
+DUE_OPTIONS = {
+    '1h': 'Через час',
+    '3h': 'Через 3 часа',
+    'eve': 'Сегодня в 20:00',
+    'tom': 'Завтра в 09:00',
+    'week': 'Через неделю',
+    'off': 'Убрать срок'
+}
+
+
+def due_from_option(option: str, now: datetime):
+    """Момент срока для выбранного варианта; None - убрать срок"""
+    if option == '1h':
+        return now + timedelta(hours=1)
+    if option == '3h':
+        return now + timedelta(hours=3)
+    if option == 'eve':
+        evening = now.replace(hour=20, minute=0, second=0, microsecond=0)
+        return evening if evening > now else evening + timedelta(days=1)
+    if option == 'tom':
+        return (now + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+    if option == 'week':
+        return now + timedelta(days=7)
+    return None
+
+
+def format_due(due_at) -> str:
+    """Пометка срока для списков"""
+    return f" ⏰ {due_at.strftime('%d.%m %H:%M')}" if due_at else ""
+
+
+@router.callback_query(Route(Due))
+async def choose_due(callback: CallbackQuery, callback_data: Due):
+    kind = callback_data.kind
+    item_id = callback_data.id
+
+    buttons = [
+        [InlineKeyboardButton(text=title, callback_data=DueSet(kind=kind, id=item_id, option=code).pack())]
+        for code, title in DUE_OPTIONS.items()
+    ]
+
+    await callback.answer()
+    return callback.message.answer(
+        "⏰ Когда напомнить?",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+
+
+@router.callback_query(Route(DueSet))
+async def set_due(callback: CallbackQuery, callback_data: DueSet):
+    kind = callback_data.kind
+    item_id = callback_data.id
+    option = callback_data.option
+    table = DUE_TABLES[kind]
+
+    due_at = due_from_option(option, datetime.now())
+    family_id = await get_family_id(callback.from_user.id)
+
+    # Напоминание приходит в момент срока; новый срок - новое напоминание
+    async with connection() as conn:
+        text = await conn.fetchval(
+            f"""UPDATE {table} SET due_at=$1, remind_at=$1, reminded=false
+                WHERE id=$2 AND family_id=$3 RETURNING text""",
+            due_at, item_id, family_id
+        )
+
+    if not text:
+        return callback.answer("Запись не найдена", show_alert=True)
+
+    await callback.message.delete()
+
+    if due_at:
+        await log_activity(family_id, callback.from_user.id, f"Установил срок {due_at.strftime('%d.%m %H:%M')}: {text}", kind)
+        return callback.answer(f"⏰ Напомню {due_at.strftime('%d.%m в %H:%M')}")
+
+    await log_activity(family_id, callback.from_user.id, f"Убрал срок: {text}", kind)
+    return callback.answer("Срок убран")
@@ -0,0 +1,122 @@
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery
+from aiogram.fsm.context import FSMContext
+from keyboards.search import search_keyboard
+from handlers.history import ACTION_EMOJI
+from db import bot, get_family_id, read_connection, is_parent
+from callbacks import SearchPage, Route
+from fsm_storage import session_expired
+
+router = Router()
+
+PAGE_SIZE = 5
+
+# Админ-логи: роли, удаления, переименования, вступления
+ADMIN_TYPES = ['role', 'remove', 'rename', 'join']
+
+FILTER_NAMES = {
+    'all': 'Все',
+    'task': 'Задачи',
+    'shopping': 'Покупки',
+    'admin': 'Админ-логи'
+}
+
+
+async def search_activity(family_id: int, query: str, filter_type: str = 'all',
+                          after_rank: float = None, after_id: int = None):
+    """Поиск по истории через GIN-индекс на action_tsv
+    
+    Результаты отсортированы по релевантности (ts_rank), листание - keyset-курсором
+    (rank, id), поэтому глубокие страницы не требуют OFFSET.
+    """
+    if filter_type == 'all':
+        types = None
+    elif filter_type == 'admin':
+        types = ADMIN_TYPES
+    else:
+        types = [filter_type]
+    
+    async with read_connection() as conn:
+        return await conn.fetch(
+            """
+            SELECT id, action, created_at, user_id, action_type,
+                   ts_rank(action_tsv, q)::float8 AS rank
+            FROM activity_log, websearch_to_tsquery('russian', $2) AS q
+            WHERE family_id=$1
+              AND action_tsv @@ q
+              AND ($3::text[] IS NULL OR action_type = ANY($3::text[]))
+              AND ($4::float8 IS NULL OR (ts_rank(action_tsv, q)::float8, id) < ($4::float8, $5::int))
+            ORDER BY rank DESC, id DESC
+            LIMIT $6
+            """,
+            family_id, query, types, after_rank, after_id, PAGE_SIZE
+        )
+
+
+async def render_results(rows, query: str, filter_type: str):
+    """Сформировать текст и клавиатуру страницы результатов"""
+    text = f"🔍 Поиск: «{query}» ({FILTER_NAMES.get(filter_type, 'Все')})\n\n"
+    
+    for r in rows:
+        time_str = r["created_at"].strftime("%d.%m.%Y %H:%M")
+        try:
+            chat = await bot.get_chat(r["user_id"])
+            name = chat.first_name
+        except:
+            name = "Неизвестно"
+        
+        emoji = ACTION_EMOJI.get(r["action_type"], "📌")
+        text += f"{emoji} {time_str} | {name}\n{r['action']}\n\n"
+    
+    next_cursor = None
+    if len(rows) == PAGE_SIZE:
+        last = rows[-1]
+        next_cursor = (last['rank'], last['id'])
+    
+    return text, search_keyboard(filter_type, next_cursor)
+
+
+@router.message(Command("search"), flags={"throttle": "expensive"})
+async def search_command(message: Message, command: CommandObject, state: FSMContext):
+    if not await is_parent(message.from_user.id):
+        return message.answer("Только родитель может искать по истории.")
+    
+    query = (command.args or "").strip()
+    if not query:
+        return message.answer("🔍 Использование: /search <запрос>\n\nНапример: /search молоко")
+    
+    family_id = await get_family_id(message.from_user.id)
+    rows = await search_activity(family_id, query)
+    
+    if not rows:
+        return message.answer(f"🔍 По запросу «{query}» ничего не найдено")
+    
+    # Запрос не помещается в callback_data (64 байта), храним его в FSM
+    await state.update_data(search_query=query)
+    
+    text, keyboard = await render_results(rows, query, 'all')
+    return message.answer(text, reply_markup=keyboard)
+
+
+@router.callback_query(Route(SearchPage), flags={"throttle": "expensive"})
+async def search_page(callback: CallbackQuery, callback_data: SearchPage, state: FSMContext):
+    data = await state.get_data()
+    query = data.get("search_query")
+    
+    if not query:
+        return await session_expired(callback, state)
+    
+    filter_type = callback_data.filter_type
+    after_rank = callback_data.rank
+    after_id = callback_data.after_id
+    
+    family_id = await get_family_id(callback.from_user.id)
+    rows = await search_activity(family_id, query, filter_type, after_rank, after_id)
+    
+    if not rows:
+        return callback.answer("🔍 Больше ничего не найдено", show_alert=True)
+    
+    text, keyboard = await render_results(rows, query, filter_type)
+    await callback.answer()
+    return callback.message.edit_text(text, reply_markup=keyboard)
@@ -1,16 +1,20 @@
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from states.user_states import UserState
-from db import get_family_id, get_pool, is_parent, log_activity, get_family_settings
+from db import get_family_id, connection, is_parent, log_activity, get_family_settings
+from keyboards.main_meny import main_menu
+from invalidation import invalidate
+from menu import MenuButton
+from callbacks import Emoji, Route
+from fsm_storage import session_expired
 
 router = Router()
 
-@router.message(F.text == "🎨 Настройки")
+@router.message(MenuButton("settings"))
 async def show_settings(message: Message):
     if not await is_parent(message.from_user.id):
-        await message.answer("Только родитель может изменять настройки.")
-        return
+        return message.answer("Только родитель может изменять настройки.")
     
     family_id = await get_family_id(message.from_user.id)
     settings = await get_family_settings(family_id)
@@ -25,26 +29,26 @@ async def show_settings(message: Message):
     text += "Выберите, что хотите изменить:"
     
     buttons = [
-        [InlineKeyboardButton(text="➕ Изменить 'Добавить'", callback_data="emoji:add")],
-        [InlineKeyboardButton(text="📋 Изменить 'Задачи'", callback_data="emoji:task")],
-        [InlineKeyboardButton(text="🛒 Изменить 'Покупки'", callback_data="emoji:shopping")],
-        [InlineKeyboardButton(text="👨‍👩‍👧‍👦 Изменить 'Семья'", callback_data="emoji:family")],
-        [InlineKeyboardButton(text="📜 Изменить 'История'", callback_data="emoji:history")],
-        [InlineKeyboardButton(text="🔄 Сбросить всё", callback_data="emoji:reset")]
+        [InlineKeyboardButton(text="➕ Изменить 'Добавить'", callback_data=Emoji(target="add").pack())],
+        [InlineKeyboardButton(text="📋 Изменить 'Задачи'", callback_data=Emoji(target="task").pack())],
+        [InlineKeyboardButton(text="🛒 Изменить 'Покупки'", callback_data=Emoji(target="shopping").pack())],
+        [InlineKeyboardButton(text="👨‍👩‍👧‍👦 Изменить 'Семья'", callback_data=Emoji(target="family").pack())],
+        [InlineKeyboardButton(text="📜 Изменить 'История'", callback_data=Emoji(target="history").pack())],
+        [InlineKeyboardButton(text="🔄 Сбросить всё", callback_data=Emoji(target="reset").pack())]
     ]
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await message.answer(text, reply_markup=keyboard)
+    return message.answer(text, reply_markup=keyboard)
 
-@router.callback_query(F.data.startswith("emoji:"))
-async def change_emoji(callback: CallbackQuery, state: FSMContext):
-    emoji_type = callback.data.split(":")[1]
+@router.callback_query(Route(Emoji))
+async def change_emoji(callback: CallbackQuery, callback_data: Emoji, state: FSMContext):
+    emoji_type = callback_data.target
     
     if emoji_type == "reset":
         # Сбрасываем все эмодзи на дефолтные
         family_id = await get_family_id(callback.from_user.id)
         
-        async with get_pool().acquire() as conn:
+        async with connection() as conn:
             await conn.execute(
                 """UPDATE families SET 
                    emoji_task='📋', emoji_shopping='🛒', emoji_family='👨‍👩‍👧‍👦',
@@ -53,10 +57,14 @@ async def change_emoji(callback: CallbackQuery, state: FSMContext):
                 family_id
             )
         
+        await invalidate("family", family_id)
         await log_activity(family_id, callback.from_user.id, "Сбросил настройки эмодзи", 'other')
         await callback.message.delete()
         await callback.answer("✅ Эмодзи сброшены на стандартные")
-        return
+        return callback.message.answer(
+            "🎨 Меню обновлено",
+            reply_markup=main_menu(True, await get_family_settings(family_id))
+        )
     
     # Запоминаем тип эмодзи для изменения
     await state.set_state(UserState.change_emoji)
@@ -70,7 +78,7 @@ async def change_emoji(callback: CallbackQuery, state: FSMContext):
         'history': 'История'
     }
     
-    await callback.message.edit_text(
+    return callback.message.edit_text(
         f"Отправьте новый эмодзи для кнопки '{emoji_names[emoji_type]}':\n\n"
         "Например: 🎯 или 🏠 или любой другой эмодзи"
     )
@@ -79,18 +87,19 @@ async def change_emoji(callback: CallbackQuery, state: FSMContext):
 async def save_emoji(message: Message, state: FSMContext):
     data = await state.get_data()
     emoji_type = data.get('emoji_type')
+    if emoji_type is None:
+        return await session_expired(message, state)
     new_emoji = message.text.strip()
     
     # Проверяем, что это один символ (эмодзи)
     if len(new_emoji) > 5:  # Эмодзи могут быть составными
-        await message.answer("❌ Пожалуйста, отправьте только один эмодзи")
-        return
+        return message.answer("❌ Пожалуйста, отправьте только один эмодзи")
     
     family_id = await get_family_id(message.from_user.id)
     
     # Обновляем эмодзи в базе
     column_name = f"emoji_{emoji_type}"
-    async with get_pool().acquire() as conn:
+    async with connection() as conn:
         await conn.execute(
             f"UPDATE families SET {column_name}=$1 WHERE id=$2",
             new_emoji, family_id
@@ -104,6 +113,10 @@ async def save_emoji(message: Message, state: FSMContext):
         'history': 'История'
     }
     
+    await invalidate("family", family_id)
     await log_activity(family_id, message.from_user.id, f"Изменил эмодзи '{emoji_names[emoji_type]}' на {new_emoji}", 'other')
     await state.clear()
-    await message.answer(f"✅ Эмодзи для '{emoji_names[emoji_type]}' изменён на {new_emoji}")
+    return message.answer(
+        f"✅ Эмодзи для '{emoji_names[emoji_type]}' изменён на {new_emoji}",
+        reply_markup=main_menu(True, await get_family_settings(family_id))
+    )
@@ -1,33 +1,53 @@
-from aiogram import Router, F
+import logging
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from db import get_family_id, get_pool, log_activity, bot
+from db import get_family_id, connection, log_activity, bot, cached_family_id, DatabaseUnavailable, UNAVAILABLE_TEXT
+from menu import MenuButton
+from handlers.checklist import load_checklists, format_checklist
+from handlers.reminders import format_due
+from handlers.bulk import bulk_button
+from suggestions import record_purchase
+from invalidation import publish
+from snapshots import remember_snapshot, last_snapshot, stale_notice
+from callbacks import ShopDone, Checklist, Due, Route
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
-@router.message(F.text == "🛒 Покупки")
+@router.message(MenuButton("shopping"), flags={"throttle": "expensive"})
 async def show_shopping(message: Message):
     try:
         family_id = await get_family_id(message.from_user.id)
         
         if not family_id:
-            await message.answer("❌ Ошибка: вы не состоите в семье")
-            return
+            return message.answer("❌ Ошибка: вы не состоите в семье")
         
-        async with get_pool().acquire() as conn:
+        async with connection() as conn:
             rows = await conn.fetch(
-                "SELECT id, text, assigned_to FROM shopping WHERE family_id=$1 AND completed=false ORDER BY created_at",
+                "SELECT id, text, assigned_to, due_at FROM shopping WHERE family_id=$1 AND completed=false ORDER BY created_at",
                 family_id
             )
+            # Чек-листы всех записей - одним запросом
+            checklists = await load_checklists(conn, 'shopping', [r['id'] for r in rows])
         
-        if not rows:
-            await message.answer("🛒 Список покупок пуст")
-            return
+        remember_snapshot(('shopping', family_id), (rows, checklists))
+        stale = ""
+    except DatabaseUnavailable:
+        # Только чтение: показываем последний снимок с пометкой
+        snapshot = last_snapshot(('shopping', cached_family_id(message.from_user.id)))
+        if snapshot is None:
+            return message.answer(UNAVAILABLE_TEXT)
+        (rows, checklists), saved_at = snapshot
+        stale = stale_notice(saved_at)
     except Exception as e:
-        print(f"Error in show_shopping: {e}")
-        await message.answer(f"❌ Ошибка при загрузке покупок: {str(e)}")
-        return
+        logger.exception("Error in show_shopping")
+        return message.answer(f"❌ Ошибка при загрузке покупок: {str(e)}")
+    
+    if not rows:
+        return message.answer(stale + "🛒 Список покупок пуст")
     
-    text = "🛒 Список покупок:\n\n"
+    text = stale + "🛒 Список покупок:\n\n"
     buttons = []
     
     for i, r in enumerate(rows, 1):
@@ -44,19 +64,36 @@ async def show_shopping(message: Message):
         else:
             shop_text += " (🌐 Всем)"
         
+        shop_text += format_due(r['due_at'])
         text += f"{i}. {shop_text}\n"
+        items = checklists.get(r['id'], [])
+        text += format_checklist(items)
+        
         button_text = r['text'] if len(r['text']) <= 25 else r['text'][:22] + "..."
-        buttons.append([InlineKeyboardButton(
-            text=f"✅ {button_text}",
-            callback_data=f"shop_done:{r['id']}"
-        )])
+        done_count = sum(1 for item in items if item['completed'])
+        buttons.append([
+            InlineKeyboardButton(
+                text=f"✅ {button_text}",
+                callback_data=ShopDone(id=r['id']).pack()
+            ),
+            InlineKeyboardButton(
+                text=f"☑️ {done_count}/{len(items)}" if items else "☑️",
+                callback_data=Checklist(kind='shopping', id=r['id']).pack()
+            ),
+            InlineKeyboardButton(
+                text="⏰",
+                callback_data=Due(kind='shopping', id=r['id']).pack()
+            )
+        ])
+    
+    buttons.append([bulk_button('shopping')])
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await message.answer(text, reply_markup=keyboard)
+    return message.answer(text, reply_markup=keyboard)
 
-@router.callback_query(F.data.startswith("shop_done:"))
-async def mark_shopping_done(callback: CallbackQuery):
-    shop_id = int(callback.data.split(":")[1])
+@router.callback_query(Route(ShopDone), flags={"throttle": "expensive"})
+async def mark_shopping_done(callback: CallbackQuery, callback_data: ShopDone):
+    shop_id = callback_data.id
     family_id = await get_family_id(callback.from_user.id)
     
     # Получаем имя выполнившего
@@ -66,7 +103,7 @@ async def mark_shopping_done(callback: CallbackQuery):
     except:
         executor_name = "Кто-то"
     
-    async with get_pool().acquire() as conn:
+    async with connection() as conn:
         shop = await conn.fetchrow(
             "SELECT text, created_by FROM shopping WHERE id=$1 AND family_id=$2",
             shop_id, family_id
@@ -74,10 +111,12 @@ async def mark_shopping_done(callback: CallbackQuery):
         
         if shop:
             await conn.execute(
-                "UPDATE shopping SET completed=true, completed_at=NOW() WHERE id=$1",
-                shop_id
+                "UPDATE shopping SET completed=true, completed_at=NOW(), completed_by=$2 WHERE id=$1",
+                shop_id, callback.from_user.id
             )
             await log_activity(family_id, callback.from_user.id, f"Купил: {shop['text']}", 'shopping')
+            record_purchase(family_id, shop['text'])
+            await publish("items", family_id)
             
             # Уведомляем создателя о выполнении
             if shop['created_by'] and shop['created_by'] != callback.from_user.id:
@@ -87,7 +126,7 @@ async def mark_shopping_done(callback: CallbackQuery):
                         f"✅ Покупка выполнена!\n\n«{shop['text']}»\n\n👤 Купил: {executor_name}"
                     )
                 except Exception as e:
-                    print(f"Failed to send completion notification: {e}")
+                    logger.warning("Failed to send completion notification: %s", e)
     
     await callback.message.delete()
-    await callback.answer("Покупка выполнена! ✅")
+    return callback.answer("Покупка выполнена! ✅")
@@ -1,8 +1,9 @@
 from aiogram import Router
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
-from db import bot, ensure_family, is_parent, get_pool, log_activity
+from db import bot, ensure_family, is_parent, connection, log_activity, get_family_settings
 from keyboards.main_meny import main_menu
+from invalidation import invalidate
 
 router = Router()
 
@@ -16,7 +17,7 @@ async def start(message: Message):
         try:
             family_id = int(args[1].replace("join_", ""))
             
-            async with get_pool().acquire() as conn:
+            async with connection() as conn:
                 # Проверяем, существует ли семья
                 family = await conn.fetchrow(
                     "SELECT name FROM families WHERE id=$1",
@@ -24,8 +25,7 @@ async def start(message: Message):
                 )
                 
                 if not family:
-                    await message.answer("❌ Семья не найдена")
-                    return
+                    return message.answer("❌ Семья не найдена")
                 
                 # Проверяем, не состоит ли пользователь уже в семье
                 existing = await conn.fetchrow(
@@ -34,8 +34,7 @@ async def start(message: Message):
                 )
                 
                 if existing:
-                    await message.answer("❌ Вы уже состоите в семье")
-                    return
+                    return message.answer("❌ Вы уже состоите в семье")
                 
                 # Добавляем пользователя в семью как ребёнка
                 await conn.execute(
@@ -43,27 +42,27 @@ async def start(message: Message):
                     family_id, message.from_user.id
                 )
             
+            await invalidate("member", message.from_user.id)
             await log_activity(family_id, message.from_user.id, "Присоединился к семье", 'join')
-            await message.answer(
+            return message.answer(
                 f"✅ Вы присоединились к семье: {family['name']}",
-                reply_markup=main_menu(False)
+                reply_markup=main_menu(False, await get_family_settings(family_id))
             )
-            return
             
         except Exception as e:
-            await message.answer(f"❌ Ошибка при присоединении: {str(e)}")
-            return
+            return message.answer(f"❌ Ошибка при присоединении: {str(e)}")
     
     # Обычный старт
     family_id = await ensure_family(message.from_user.id)
     parent = await is_parent(message.from_user.id)
+    settings = await get_family_settings(family_id)
 
-    await message.answer(
+    return message.answer(
         "🏠 Добро пожаловать в семейный бот!\n\n"
         "Здесь вы можете:\n"
         "• Создавать задачи и списки покупок\n"
         "• Отмечать выполненные дела\n"
         "• Просматривать историю активности\n"
         "• Управлять семьёй",
-        reply_markup=main_menu(parent)
+        reply_markup=main_menu(parent, settings)
     )
@@ -0,0 +1,120 @@
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from db import bot, get_family_id, read_connection, is_parent
+from callbacks import Stats, Route
+
+router = Router()
+
+# Период -> (название, сколько дней назад включительно)
+PERIODS = {
+    'day': ('сегодня', 0),
+    'week': ('за 7 дней', 6),
+    'month': ('за 30 дней', 29)
+}
+
+
+def stats_keyboard(period: str):
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(
+            text=f"• {title}" if key == period else title,
+            callback_data=Stats(period=key).pack()
+        )
+        for key, (title, _) in PERIODS.items()
+    ]])
+
+
+def format_duration(seconds: float) -> str:
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} ч"
+    return f"{seconds / 86400:.1f} дн"
+
+
+async def build_stats(family_id: int, period: str) -> str:
+    """Статистика по участникам из дневных агрегатов и открытых задач"""
+    title, days = PERIODS[period]
+
+    async with read_connection() as conn:
+        done = await conn.fetch(
+            """SELECT user_id, kind, SUM(completed) AS completed, SUM(total_seconds) AS seconds
+               FROM member_daily_stats
+               WHERE family_id=$1 AND day >= CURRENT_DATE - $2::int
+               GROUP BY user_id, kind""",
+            family_id, days
+        )
+
+        backlog = await conn.fetch(
+            """SELECT assigned_to, 'task' AS kind, COUNT(*) AS open
+               FROM tasks WHERE family_id=$1 AND completed=false GROUP BY assigned_to
+               UNION ALL
+               SELECT assigned_to, 'shopping' AS kind, COUNT(*) AS open
+               FROM shopping WHERE family_id=$1 AND completed=false GROUP BY assigned_to""",
+            family_id
+        )
+
+        members = await conn.fetch(
+            "SELECT user_id FROM family_members WHERE family_id=$1",
+            family_id
+        )
+
+    stats = {}
+    for r in done:
+        entry = stats.setdefault(r['user_id'], {'task': 0, 'shopping': 0, 'seconds': 0.0, 'open': 0})
+        entry[r['kind']] += r['completed']
+        entry['seconds'] += r['seconds']
+
+    unassigned_open = 0
+    for r in backlog:
+        if r['assigned_to'] is None:
+            unassigned_open += r['open']
+            continue
+        entry = stats.setdefault(r['assigned_to'], {'task': 0, 'shopping': 0, 'seconds': 0.0, 'open': 0})
+        entry['open'] += r['open']
+
+    member_ids = [m['user_id'] for m in members]
+    user_ids = member_ids + [u for u in stats if u not in member_ids]
+
+    text = f"📊 Статистика {title}\n\n"
+    for user_id in user_ids:
+        entry = stats.get(user_id, {'task': 0, 'shopping': 0, 'seconds': 0.0, 'open': 0})
+        try:
+            chat = await bot.get_chat(user_id)
+            name = chat.first_name
+        except:
+            name = "Неизвестно"
+
+        total = entry['task'] + entry['shopping']
+        text += f"👤 {name}\n"
+        text += f"📋 Задач: {entry['task']}  🛒 Покупок: {entry['shopping']}\n"
+        if total:
+            text += f"⏱ Среднее время: {format_duration(entry['seconds'] / total)}\n"
+        text += f"📌 Открыто: {entry['open']}\n\n"
+
+    if unassigned_open:
+        text += f"🌐 Открыто для всех: {unassigned_open}\n"
+
+    return text
+
+
+@router.message(Command("stats"), flags={"throttle": "expensive"})
+async def show_stats(message: Message):
+    if not await is_parent(message.from_user.id):
+        return message.answer("Только родитель может смотреть статистику.")
+
+    family_id = await get_family_id(message.from_user.id)
+    text = await build_stats(family_id, 'week')
+    return message.answer(text, reply_markup=stats_keyboard('week'))
+
+
+@router.callback_query(Route(Stats), flags={"throttle": "expensive"})
+async def change_period(callback: CallbackQuery, callback_data: Stats):
+    period = callback_data.period
+    if period not in PERIODS:
+        return callback.answer()
+
+    family_id = await get_family_id(callback.from_user.id)
+    text = await build_stats(family_id, period)
+    await callback.answer()
+    return callback.message.edit_text(text, reply_markup=stats_keyboard(period))
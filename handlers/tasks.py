@@ -1,37 +1,77 @@
-from aiogram import Router, F
+import logging
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from states.user_states import UserState
 from keyboards.confirm import confirm_keyboard
-from db import get_family_id, get_pool, log_activity, bot
+from db import get_family_id, connection, log_activity, bot, cached_family_id, DatabaseUnavailable, UNAVAILABLE_TEXT
+from menu import MenuButton
+from handlers.checklist import load_checklists, format_checklist
+from handlers.reminders import format_due
+from handlers.bulk import bulk_button
+from suggestions import suggest
+from log import sampled
+from fsm_storage import session_expired
+from invalidation import publish
+from snapshots import remember_snapshot, last_snapshot, stale_notice
+from callbacks import Suggest, Confirm, Assign, TaskDone, Checklist, Due, Route
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
-@router.message(F.text == "➕ Добавить")
+@router.message(MenuButton("add"))
 async def add_task(message: Message, state: FSMContext):
     await state.set_state(UserState.confirm_type)
-    await message.answer("Введите текст задачи или покупки:")
+    return message.answer("Введите текст задачи или покупки:")
 
 @router.message(UserState.confirm_type)
 async def choose_type(message: Message, state: FSMContext):
-    await state.update_data(text=message.text)
-    await message.answer(
+    if not message.text:
+        return message.answer("Отправьте текст задачи или покупки:")
+    
+    family_id = await get_family_id(message.from_user.id)
+    suggestions = await suggest(family_id, message.text) if family_id else []
+    
+    await state.update_data(text=message.text, suggestions=suggestions)
+    return message.answer(
         f"Добавить:\n\n«{message.text}»",
+        reply_markup=confirm_keyboard(suggestions)
+    )
+
+@router.callback_query(Route(Suggest))
+async def apply_suggestion(callback: CallbackQuery, callback_data: Suggest, state: FSMContext):
+    data = await state.get_data()
+    if data.get("text") is None:
+        return await session_expired(callback, state)
+    suggestions = data.get("suggestions") or []
+    index = callback_data.index
+    
+    if index >= len(suggestions):
+        return callback.answer("Подсказка устарела", show_alert=True)
+    
+    text = suggestions[index]
+    await state.update_data(text=text, suggestions=[])
+    await callback.answer()
+    return callback.message.edit_text(
+        f"Добавить:\n\n«{text}»",
         reply_markup=confirm_keyboard()
     )
 
-@router.callback_query(F.data.startswith("confirm:"))
-async def confirm_add(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(Route(Confirm), flags={"throttle": "expensive"})
+async def confirm_add(callback: CallbackQuery, callback_data: Confirm, state: FSMContext):
     data = await state.get_data()
     text = data.get("text")
-    task_type = callback.data.split(":")[1]
+    if text is None:
+        return await session_expired(callback, state)
+    task_type = callback_data.kind
     
     await state.update_data(task_type=task_type)
     
     # Показываем список членов семьи для выбора исполнителя
     family_id = await get_family_id(callback.from_user.id)
     
-    async with get_pool().acquire() as conn:
+    async with connection() as conn:
         members = await conn.fetch(
             "SELECT user_id FROM family_members WHERE family_id=$1",
             family_id
@@ -47,28 +87,29 @@ async def confirm_add(callback: CallbackQuery, state: FSMContext):
         
         buttons.append([InlineKeyboardButton(
             text=f"👤 {name}",
-            callback_data=f"assign:{task_type}:{member['user_id']}"
+            callback_data=Assign(kind=task_type, user_id=member['user_id']).pack()
         )])
     
     buttons.append([InlineKeyboardButton(
         text="🌐 Всем",
-        callback_data=f"assign:{task_type}:all"
+        callback_data=Assign(kind=task_type).pack()
     )])
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await callback.message.edit_text(
+    return callback.message.edit_text(
         f"Кому назначить?\n\n«{text}»",
         reply_markup=keyboard
     )
 
-@router.callback_query(F.data.startswith("assign:"))
-async def assign_task(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(Route(Assign), flags={"throttle": "expensive"})
+async def assign_task(callback: CallbackQuery, callback_data: Assign, state: FSMContext):
     data = await state.get_data()
     text = data.get("text")
+    if text is None:
+        return await session_expired(callback, state)
     
-    parts = callback.data.split(":")
-    task_type = parts[1]
-    assigned_to = None if parts[2] == "all" else int(parts[2])
+    task_type = callback_data.kind
+    assigned_to = callback_data.user_id
     
     family_id = await get_family_id(callback.from_user.id)
     
@@ -79,7 +120,7 @@ async def assign_task(callback: CallbackQuery, state: FSMContext):
     except:
         creator_name = "Кто-то"
     
-    async with get_pool().acquire() as conn:
+    async with connection() as conn:
         if task_type == "task":
             await conn.execute(
                 "INSERT INTO tasks (family_id, text, created_by, assigned_to) VALUES ($1,$2,$3,$4)",
@@ -97,6 +138,8 @@ async def assign_task(callback: CallbackQuery, state: FSMContext):
             task_emoji = "🛒"
             task_name = "покупку"
     
+    await publish("items", family_id)
+    
     # Отправляем уведомление
     notification_sent = False
     if assigned_to and assigned_to != callback.from_user.id:
@@ -106,12 +149,12 @@ async def assign_task(callback: CallbackQuery, state: FSMContext):
                 f"{task_emoji} Вам назначена {task_name}:\n\n«{text}»\n\n👤 От: {creator_name}"
             )
             notification_sent = True
-            print(f"Notification sent to {assigned_to}")
+            sampled(logger, "notification_sent", 50, "Notification sent", recipient=assigned_to)
         except Exception as e:
-            print(f"Failed to send notification to {assigned_to}: {e}")
+            logger.warning("Failed to send notification: %s", e, extra={"recipient": assigned_to})
     elif not assigned_to:
         # Уведомляем всех членов семьи
-        async with get_pool().acquire() as conn:
+        async with connection() as conn:
             members = await conn.fetch(
                 "SELECT user_id FROM family_members WHERE family_id=$1 AND user_id!=$2",
                 family_id, callback.from_user.id
@@ -124,41 +167,50 @@ async def assign_task(callback: CallbackQuery, state: FSMContext):
                     f"{task_emoji} Новая {task_name} для всех:\n\n«{text}»\n\n👤 От: {creator_name}"
                 )
                 notification_sent = True
-                print(f"Notification sent to {member['user_id']}")
+                sampled(logger, "notification_sent", 50, "Notification sent", recipient=member['user_id'])
             except Exception as e:
-                print(f"Failed to send notification to {member['user_id']}: {e}")
+                logger.warning("Failed to send notification: %s", e, extra={"recipient": member['user_id']})
     
     if not notification_sent and (assigned_to or not assigned_to):
-        print(f"Warning: No notifications were sent for task/shopping: {text}")
+        logger.warning("No notifications were sent", extra={"text": text})
     
     await state.clear()
     await callback.message.delete()
-    await callback.answer("Добавлено ✅")
+    return callback.answer("Добавлено ✅")
 
-@router.message(F.text == "📋 Задачи")
+@router.message(MenuButton("tasks"), flags={"throttle": "expensive"})
 async def show_tasks(message: Message):
     try:
         family_id = await get_family_id(message.from_user.id)
         
         if not family_id:
-            await message.answer("❌ Ошибка: вы не состоите в семье")
-            return
+            return message.answer("❌ Ошибка: вы не состоите в семье")
         
-        async with get_pool().acquire() as conn:
+        async with connection() as conn:
             rows = await conn.fetch(
-                "SELECT id, text, assigned_to FROM tasks WHERE family_id=$1 AND completed=false ORDER BY created_at",
+                "SELECT id, text, assigned_to, due_at FROM tasks WHERE family_id=$1 AND completed=false ORDER BY created_at",
                 family_id
             )
+            # Чек-листы всех записей - одним запросом
+            checklists = await load_checklists(conn, 'task', [r['id'] for r in rows])
         
-        if not rows:
-            await message.answer("📋 Нет активных задач")
-            return
+        remember_snapshot(('task', family_id), (rows, checklists))
+        stale = ""
+    except DatabaseUnavailable:
+        # Только чтение: показываем последний снимок с пометкой
+        snapshot = last_snapshot(('task', cached_family_id(message.from_user.id)))
+        if snapshot is None:
+            return message.answer(UNAVAILABLE_TEXT)
+        (rows, checklists), saved_at = snapshot
+        stale = stale_notice(saved_at)
     except Exception as e:
-        print(f"Error in show_tasks: {e}")
-        await message.answer(f"❌ Ошибка при загрузке задач: {str(e)}")
-        return
+        logger.exception("Error in show_tasks")
+        return message.answer(f"❌ Ошибка при загрузке задач: {str(e)}")
+    
+    if not rows:
+        return message.answer(stale + "📋 Нет активных задач")
     
-    text = "📋 Активные задачи:\n\n"
+    text = stale + "📋 Активные задачи:\n\n"
     buttons = []
     
     for i, r in enumerate(rows, 1):
@@ -175,19 +227,36 @@ async def show_tasks(message: Message):
         else:
             task_text += " (🌐 Всем)"
         
+        task_text += format_due(r['due_at'])
         text += f"{i}. {task_text}\n"
+        items = checklists.get(r['id'], [])
+        text += format_checklist(items)
+        
         button_text = r['text'] if len(r['text']) <= 25 else r['text'][:22] + "..."
-        buttons.append([InlineKeyboardButton(
-            text=f"✅ {button_text}",
-            callback_data=f"task_done:{r['id']}"
-        )])
+        done_count = sum(1 for item in items if item['completed'])
+        buttons.append([
+            InlineKeyboardButton(
+                text=f"✅ {button_text}",
+                callback_data=TaskDone(id=r['id']).pack()
+            ),
+            InlineKeyboardButton(
+                text=f"☑️ {done_count}/{len(items)}" if items else "☑️",
+                callback_data=Checklist(kind='task', id=r['id']).pack()
+            ),
+            InlineKeyboardButton(
+                text="⏰",
+                callback_data=Due(kind='task', id=r['id']).pack()
+            )
+        ])
+    
+    buttons.append([bulk_button('task')])
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    await message.answer(text, reply_markup=keyboard)
+    return message.answer(text, reply_markup=keyboard)
 
-@router.callback_query(F.data.startswith("task_done:"))
-async def mark_task_done(callback: CallbackQuery):
-    task_id = int(callback.data.split(":")[1])
+@router.callback_query(Route(TaskDone), flags={"throttle": "expensive"})
+async def mark_task_done(callback: CallbackQuery, callback_data: TaskDone):
+    task_id = callback_data.id
     family_id = await get_family_id(callback.from_user.id)
     
     # Получаем имя выполнившего
@@ -197,7 +266,7 @@ async def mark_task_done(callback: CallbackQuery):
     except:
         executor_name = "Кто-то"
     
-    async with get_pool().acquire() as conn:
+    async with connection() as conn:
         task = await conn.fetchrow(
             "SELECT text, created_by FROM tasks WHERE id=$1 AND family_id=$2",
             task_id, family_id
@@ -205,10 +274,11 @@ async def mark_task_done(callback: CallbackQuery):
         
         if task:
             await conn.execute(
-                "UPDATE tasks SET completed=true, completed_at=NOW() WHERE id=$1",
-                task_id
+                "UPDATE tasks SET completed=true, completed_at=NOW(), completed_by=$2 WHERE id=$1",
+                task_id, callback.from_user.id
             )
             await log_activity(family_id, callback.from_user.id, f"Выполнил задачу: {task['text']}", 'task')
+            await publish("items", family_id)
             
             # Уведомляем создателя о выполнении
             if task['created_by'] and task['created_by'] != callback.from_user.id:
@@ -218,7 +288,7 @@ async def mark_task_done(callback: CallbackQuery):
                         f"✅ Задача выполнена!\n\n«{task['text']}»\n\n👤 Выполнил: {executor_name}"
                     )
                 except Exception as e:
-                    print(f"Failed to send completion notification: {e}")
+                    logger.warning("Failed to send completion notification: %s", e)
     
     await callback.message.delete()
-    await callback.answer("Задача выполнена! ✅")
+    return callback.answer("Задача выполнена! ✅")
@@ -0,0 +1,113 @@
+"""
+Сброс кэшей между репликами через LISTEN/NOTIFY
+
+Запись публикует короткое сообщение "вид:ключ:реплика" в канал
+cache_invalidation. Каждая реплика держит одно выделенное соединение с
+LISTEN и сбрасывает у себя указанные ключи. Пока соединения нет, сообщения
+теряются, поэтому после его потери кэши сбрасываются целиком.
+
+Виды ключей:
+- member - user_id: семья и роль участника (вступление, удаление, смена роли)
+- family - family_id: название и эмодзи семьи
+- items - family_id: задачи и покупки семьи (добавление, выполнение)
+"""
+import asyncio
+import logging
+import os
+import asyncpg
+from config import DATABASE_URL
+from db import connection, forget_member, forget_all_members
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+
+# Как часто проверять, живо ли LISTEN-соединение, и пауза перед переподключением
+HEALTHCHECK_INTERVAL = 30
+RECONNECT_DELAY = 5
+
+# Метка реплики: свои же сообщения повторно не применяем
+ORIGIN = os.urandom(4).hex()
+
+# Вид ключа -> функции сброса одного ключа; функции полного сброса
+_handlers = {}
+_flush_handlers = []
+
+
+def subscribe(kind: str, evict, flush=None):
+    """Зарегистрировать кэш: evict(key) сбрасывает ключ, flush() - всё"""
+    _handlers.setdefault(kind, []).append(evict)
+    if flush and flush not in _flush_handlers:
+        _flush_handlers.append(flush)
+
+
+def _evict(kind: str, key: int):
+    for evict in _handlers.get(kind, []):
+        evict(key)
+
+
+def flush():
+    """Сбросить все кэши (после потери LISTEN-соединения)"""
+    for handler in _flush_handlers:
+        handler()
+    metrics.inc("cache_flushes_total")
+
+
+async def publish(kind: str, key: int):
+    """Сообщить остальным репликам; внутри транзакции уйдёт при COMMIT"""
+    async with connection() as conn:
+        await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, f"{kind}:{key}:{ORIGIN}")
+    metrics.inc("cache_invalidations_published_total", kind=kind)
+
+
+async def invalidate(kind: str, key: int):
+    """Сбросить ключ у себя и у остальных реплик"""
+    _evict(kind, key)
+    await publish(kind, key)
+
+
+def _on_notify(conn, pid, channel, payload):
+    try:
+        kind, key, origin = payload.split(":")
+        key = int(key)
+    except ValueError:
+        logger.warning("Malformed invalidation payload: %s", payload)
+        return
+    if origin == ORIGIN:
+        return
+    _evict(kind, key)
+    metrics.inc("cache_invalidations_received_total", kind=kind)
+
+
+async def listen():
+    """Держать LISTEN-соединение, переподключаясь с полным сбросом кэшей"""
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL)
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _: lost.set())
+            await conn.add_listener(CHANNEL, _on_notify)
+            # Всё, что публиковалось, пока нас не было, потеряно
+            flush()
+            logger.info("Listening for cache invalidations", extra={"origin": ORIGIN})
+
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), HEALTHCHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    await conn.fetchval("SELECT 1", timeout=5)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Invalidation listener lost: %s", e)
+        finally:
+            if conn and not conn.is_closed():
+                conn.terminate()
+
+        flush()
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+subscribe("member", forget_member, forget_all_members)
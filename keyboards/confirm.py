@@ -1,11 +1,16 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from callbacks import Suggest, Confirm
 
-def confirm_keyboard():
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="📋 Задача", callback_data="confirm:task"),
-                InlineKeyboardButton(text="🛒 Покупка", callback_data="confirm:shopping")
-            ]
-        ]
-    )
+def confirm_keyboard(suggestions: list = None):
+    buttons = []
+    
+    # Подсказки из истории покупок (индекс в списке, сам текст хранится в FSM)
+    for i, item in enumerate(suggestions or []):
+        buttons.append([InlineKeyboardButton(text=f"💡 {item}", callback_data=Suggest(index=i).pack())])
+    
+    buttons.append([
+        InlineKeyboardButton(text="📋 Задача", callback_data=Confirm(kind="task").pack()),
+        InlineKeyboardButton(text="🛒 Покупка", callback_data=Confirm(kind="shopping").pack())
+    ])
+    
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -1,4 +1,5 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from callbacks import HistoryPage, HistoryFilter
 
 def history_keyboard(page: int, has_next: bool, filter_type: str = 'all'):
     """Клавиатура для навигации по истории с фильтрами"""
@@ -8,26 +9,26 @@ def history_keyboard(page: int, has_next: bool, filter_type: str = 'all'):
     filter_buttons = [
         InlineKeyboardButton(
             text="🌐 Все" if filter_type == 'all' else "○ Все",
-            callback_data=f"history_filter:all:0"
+            callback_data=HistoryFilter(filter_type="all", page=0).pack()
         ),
         InlineKeyboardButton(
             text="📋 Задачи" if filter_type == 'task' else "○ Задачи",
-            callback_data=f"history_filter:task:0"
+            callback_data=HistoryFilter(filter_type="task", page=0).pack()
         ),
         InlineKeyboardButton(
             text="🛒 Покупки" if filter_type == 'shopping' else "○ Покупки",
-            callback_data=f"history_filter:shopping:0"
+            callback_data=HistoryFilter(filter_type="shopping", page=0).pack()
         )
     ]
     
     admin_filter_buttons = [
         InlineKeyboardButton(
             text="👑 Роли" if filter_type == 'role' else "○ Роли",
-            callback_data=f"history_filter:role:0"
+            callback_data=HistoryFilter(filter_type="role", page=0).pack()
         ),
         InlineKeyboardButton(
             text="🗂 Админ" if filter_type == 'admin' else "○ Админ",
-            callback_data=f"history_filter:admin:0"
+            callback_data=HistoryFilter(filter_type="admin", page=0).pack()
         )
     ]
     
@@ -38,12 +39,12 @@ def history_keyboard(page: int, has_next: bool, filter_type: str = 'all'):
     nav_buttons = []
     if page > 0:
         nav_buttons.append(
-            InlineKeyboardButton(text="⬅ Назад", callback_data=f"history:{filter_type}:{page-1}")
+            InlineKeyboardButton(text="⬅ Назад", callback_data=HistoryPage(filter_type=filter_type, page=page - 1).pack())
         )
 
     if has_next:
         nav_buttons.append(
-            InlineKeyboardButton(text="Вперёд ➡", callback_data=f"history:{filter_type}:{page+1}")
+            InlineKeyboardButton(text="Вперёд ➡", callback_data=HistoryPage(filter_type=filter_type, page=page + 1).pack())
         )
     
     if nav_buttons:
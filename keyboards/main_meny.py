@@ -1,22 +1,54 @@
+from functools import lru_cache
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
+# Настраиваемые кнопки меню: действие -> (колонка эмодзи в families, эмодзи по умолчанию, подпись)
+MENU_ITEMS = {
+    'add': ('emoji_add', '➕', 'Добавить'),
+    'tasks': ('emoji_task', '📋', 'Задачи'),
+    'shopping': ('emoji_shopping', '🛒', 'Покупки'),
+    'family': ('emoji_family', '👨‍👩‍👧‍👦', 'Семья'),
+    'history': ('emoji_history', '📜', 'История')
+}
 
-def main_menu(is_parent: bool):
+# Постоянные кнопки родителя: действие -> текст
+PARENT_BUTTONS = {
+    'rename': "✏️ Название семьи",
+    'settings': "🎨 Настройки",
+    'invite': "👨‍👩‍👧‍👦 Пригласить"
+}
+
+
+def menu_labels(settings: dict = None) -> dict:
+    """Подписи кнопок меню для настроек семьи: действие -> текст кнопки"""
+    return {
+        action: f"{(settings or {}).get(column) or default} {name}"
+        for action, (column, default, name) in MENU_ITEMS.items()
+    }
+
+
+@lru_cache(maxsize=256)
+def _build_menu(is_parent: bool, labels: tuple):
+    labels = dict(labels)
     rows = [
-        [KeyboardButton(text="➕ Добавить")],
+        [KeyboardButton(text=labels['add'])],
         [
-            KeyboardButton(text="📋 Задачи"),
-            KeyboardButton(text="🛒 Покупки")
+            KeyboardButton(text=labels['tasks']),
+            KeyboardButton(text=labels['shopping'])
         ],
-        [KeyboardButton(text="👨‍👩‍👧‍👦 Семья")]
+        [KeyboardButton(text=labels['family'])]
     ]
 
     if is_parent:
-        rows.append([KeyboardButton(text="📜 История")])
+        rows.append([KeyboardButton(text=labels['history'])])
         rows.append([
-            KeyboardButton(text="✏️ Название семьи"),
-            KeyboardButton(text="🎨 Настройки")
+            KeyboardButton(text=PARENT_BUTTONS['rename']),
+            KeyboardButton(text=PARENT_BUTTONS['settings'])
         ])
-        rows.append([KeyboardButton(text="👨‍👩‍👧‍👦 Пригласить")])
+        rows.append([KeyboardButton(text=PARENT_BUTTONS['invite'])])
 
     return ReplyKeyboardMarkup(keyboard=rows, resize_keyboard=True)
+
+
+def main_menu(is_parent: bool, settings: dict = None):
+    # Клавиатура кэшируется по набору подписей - одна на каждую версию настроек
+    return _build_menu(is_parent, tuple(sorted(menu_labels(settings).items())))
@@ -0,0 +1,38 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from callbacks import SearchPage
+
+def search_keyboard(filter_type: str = 'all', next_cursor: tuple = None):
+    """Клавиатура результатов поиска: фильтры по типу и курсор следующей страницы"""
+    buttons = []
+    
+    # Кнопки фильтрации (всегда ведут на первую страницу)
+    filter_buttons = [
+        InlineKeyboardButton(
+            text="🌐 Все" if filter_type == 'all' else "○ Все",
+            callback_data=SearchPage(filter_type="all").pack()
+        ),
+        InlineKeyboardButton(
+            text="📋 Задачи" if filter_type == 'task' else "○ Задачи",
+            callback_data=SearchPage(filter_type="task").pack()
+        ),
+        InlineKeyboardButton(
+            text="🛒 Покупки" if filter_type == 'shopping' else "○ Покупки",
+            callback_data=SearchPage(filter_type="shopping").pack()
+        ),
+        InlineKeyboardButton(
+            text="🗂 Админ" if filter_type == 'admin' else "○ Админ",
+            callback_data=SearchPage(filter_type="admin").pack()
+        )
+    ]
+    buttons.append(filter_buttons)
+    
+    # Навигация: курсор = ранг и id последней показанной записи
+    if next_cursor:
+        buttons.append([
+            InlineKeyboardButton(
+                text="Вперёд ➡",
+                callback_data=SearchPage(filter_type=filter_type, rank=next_cursor[0], after_id=next_cursor[1]).pack()
+            )
+        ])
+    
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
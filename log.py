@@ -0,0 +1,131 @@
+"""
+Структурированные логи: JSON-строки через очередь, с контекстом апдейта
+
+Запись в stdout делает отдельный поток QueueListener, поэтому event loop
+никогда не ждёт ввода-вывода. Каждая строка получает update_id, user_id и
+family_id текущего апдейта из contextvar.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from contextvars import ContextVar
+
+# Контекст текущего апдейта (словарь заводит middleware на каждый апдейт)
+_context = ContextVar("log_context", default=None)
+
+# Счётчики для выборочных событий: ключ -> сколько раз встречалось
+_sample_counts = {}
+
+_listener = None
+
+# Поля LogRecord, которые не надо переносить в JSON как extra
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class ContextFilter(logging.Filter):
+    """Скопировать контекст апдейта в запись (в потоке, где вызван логгер)"""
+
+    def filter(self, record):
+        context = _context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Как QueueHandler, но traceback уходит отдельным полем, а не в msg"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+            record.exc_text = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = "INFO"):
+    """Перевести корневой логгер на неблокирующую запись JSON-строк"""
+    global _listener
+    if _listener:
+        return
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def bind(**fields):
+    """Добавить поля в контекст текущего апдейта"""
+    context = _context.get()
+    if context is not None:
+        context.update(fields)
+
+
+def bind_member(user_id: int, family_id: int):
+    """Запомнить семью в контексте, если это семья автора апдейта
+
+    Вызывается там, где семья становится известна (db._remember_member),
+    поэтому family_id есть и у пользователей, которых ещё нет в кэше.
+    """
+    context = _context.get()
+    if context is not None and context.get("user_id") == user_id:
+        bind(family_id=family_id)
+
+
+async def log_context_middleware(handler, event, data):
+    """Outer-middleware апдейтов: заводит контекст логов на апдейт"""
+    user = data.get("event_from_user")
+    context = {"update_id": event.update_id}
+    if user:
+        context["user_id"] = user.id
+    token = _context.set(context)
+    try:
+        return await handler(event, data)
+    finally:
+        _context.reset(token)
+
+
+def sampled(logger: logging.Logger, key: str, every: int, msg: str, *args, level=logging.INFO, **extra):
+    """Записать только каждое every-е событие key (с числом пропущенных)
+
+    Для событий, которые при рассылках идут сотнями в секунду.
+    """
+    count = _sample_counts.get(key, 0) + 1
+    _sample_counts[key] = count
+    if count % every == 1 or every == 1:
+        logger.log(level, msg, *args, extra={**extra, "sample_every": every, "sample_count": count})
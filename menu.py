@@ -0,0 +1,81 @@
+"""
+Маршрутизация кнопок главного меню с учётом эмодзи семьи
+
+Для каждой семьи заранее строится таблица «текст кнопки -> действие»,
+так что нажатие кнопки разбирается одним поиском в словаре. Разбор делает
+middleware один раз на сообщение, фильтры MenuButton только сравнивают.
+"""
+from aiogram.filters import Filter
+from aiogram.types import Message
+from db import get_family_id, get_family_settings, cached_family_id, DatabaseUnavailable
+from keyboards.main_meny import MENU_ITEMS, PARENT_BUTTONS, menu_labels
+import invalidation
+
+# Сколько семей держим в кэше
+MAX_CACHED = 10000
+
+# Подписи по умолчанию работают у всех семей (например, со старой клавиатурой)
+DEFAULT_ROUTES = {label: action for action, label in menu_labels().items()}
+DEFAULT_ROUTES.update({label: action for action, label in PARENT_BUTTONS.items()})
+
+# Слово подписи -> действие: по нему отсекаем обычный текст без обращения к базе
+MENU_WORDS = {name: action for action, (_, _, name) in MENU_ITEMS.items()}
+
+_routes = {}
+
+
+def invalidate_family(family_id: int):
+    """Сбросить таблицу семьи (после смены эмодзи)"""
+    _routes.pop(family_id, None)
+
+
+async def resolve(user_id: int, text: str):
+    """Действие меню для текста сообщения или None"""
+    if not text:
+        return None
+
+    action = DEFAULT_ROUTES.get(text)
+    if action:
+        return action
+
+    word = text.rpartition(" ")[2]
+    if word not in MENU_WORDS:
+        return None
+
+    family_id = cached_family_id(user_id)
+    routes = _routes.get(family_id) if family_id is not None else None
+    if routes is None:
+        try:
+            if family_id is None:
+                family_id = await get_family_id(user_id)
+                if family_id is None:
+                    return None
+            settings = await get_family_settings(family_id)
+        except DatabaseUnavailable:
+            # Без базы эмодзи семьи не узнать: узнаём кнопку по слову подписи
+            return MENU_WORDS[word]
+        routes = {label: action for action, label in menu_labels(settings).items()}
+        if len(_routes) >= MAX_CACHED:
+            _routes.clear()
+        _routes[family_id] = routes
+
+    return routes.get(text)
+
+
+async def route_menu(handler, event: Message, data: dict):
+    """Outer-middleware сообщений: определить кнопку меню один раз на апдейт"""
+    data["menu_action"] = await resolve(event.from_user.id, event.text) if event.from_user else None
+    return await handler(event, data)
+
+
+class MenuButton(Filter):
+    """Фильтр: сообщение - нажатие кнопки меню action"""
+
+    def __init__(self, action: str):
+        self.action = action
+
+    async def __call__(self, message: Message, menu_action=None) -> bool:
+        return menu_action == self.action
+
+
+invalidation.subscribe("family", invalidate_family, _routes.clear)
@@ -0,0 +1,55 @@
+"""
+Простые метрики процесса в текстовом формате Prometheus (/metrics)
+"""
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+_counters = defaultdict(float)
+_gauges = {}
+_gauge_callbacks = {}
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Увеличить счётчик"""
+    _counters[_key(name, labels)] += value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Выставить текущее значение"""
+    _gauges[_key(name, labels)] = value
+
+
+def register_gauge(name: str, callback):
+    """Значение, которое вычисляется в момент чтения метрик"""
+    _gauge_callbacks[name] = callback
+
+
+def counter_value(name: str, **labels) -> float:
+    return _counters.get(_key(name, labels), 0)
+
+
+def _format(name: str, labels: tuple, value: float) -> str:
+    if labels:
+        label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+        return f"{name}{{{label_str}}} {value}"
+    return f"{name} {value}"
+
+
+def render() -> str:
+    lines = []
+    for (name, labels), value in sorted(_counters.items()):
+        lines.append(_format(name, labels, value))
+    for (name, labels), value in sorted(_gauges.items()):
+        lines.append(_format(name, labels, value))
+    for name, callback in sorted(_gauge_callbacks.items()):
+        try:
+            lines.append(_format(name, (), callback()))
+        except Exception as e:
+            logger.warning("Failed to read gauge %s: %s", name, e)
+    return "\n".join(lines) + "\n"
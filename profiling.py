@@ -0,0 +1,264 @@
+"""
+Диагностика под нагрузкой: профилирование CPU и памяти по запросу,
+монитор задержек event loop и gauges для поиска утечек
+
+Админские маршруты закрыты токеном ADMIN_TOKEN (Authorization: Bearer ...);
+без токена они не регистрируются вовсе.
+"""
+import asyncio
+import cProfile
+import hmac
+import logging
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from aiohttp import web
+from config import ADMIN_TOKEN, LOOP_LAG_MS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ограничения на профилирование по запросу
+MAX_PROFILE_SECONDS = 60
+SAMPLE_INTERVAL = 0.005
+
+# Сколько кадров стека хранит tracemalloc для каждой аллокации
+TRACEMALLOC_FRAMES = 1
+
+_profiling = asyncio.Lock()
+_memory_baseline = None
+
+
+def admin_only(handler):
+    """Пропускать к маршруту только запросы с админским токеном"""
+    async def wrapper(request: web.Request):
+        header = request.headers.get("Authorization", "")
+        if not ADMIN_TOKEN or not hmac.compare_digest(header.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        return await handler(request)
+    return wrapper
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def collapse_stack(frame) -> str:
+    """Стек от корня к листу в формате flamegraph (a;b;c)"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sample(thread_id: int, seconds: float) -> Counter:
+    """Сэмплировать стек потока event loop из отдельного потока"""
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            stacks[collapse_stack(frame)] += 1
+        time.sleep(SAMPLE_INTERVAL)
+    return stacks
+
+
+async def _profile_pstats(seconds: float) -> bytes:
+    """cProfile потока event loop на seconds секунд, результат - файл pstats"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+
+    fd, path = tempfile.mkstemp(suffix=".pstats")
+    os.close(fd)
+    try:
+        pstats.Stats(profiler).dump_stats(path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.unlink(path)
+
+
+@admin_only
+async def profile_endpoint(request: web.Request):
+    """GET /admin/profile?seconds=N&format=collapsed|pstats"""
+    try:
+        seconds = min(float(request.query.get("seconds", "10")), MAX_PROFILE_SECONDS)
+    except ValueError:
+        return web.json_response({"error": "seconds must be a number"}, status=400)
+    fmt = request.query.get("format", "collapsed")
+    if fmt not in ("collapsed", "pstats"):
+        return web.json_response({"error": "format must be collapsed or pstats"}, status=400)
+
+    if _profiling.locked():
+        return web.json_response({"error": "profiling already running"}, status=409)
+
+    async with _profiling:
+        logger.info("Profiling started", extra={"seconds": seconds, "format": fmt})
+        if fmt == "pstats":
+            body = await _profile_pstats(seconds)
+            return web.Response(
+                body=body,
+                content_type="application/octet-stream",
+                headers={"Content-Disposition": "attachment; filename=profile.pstats"}
+            )
+
+        # Сэмплер живёт в своём потоке и не мешает циклу
+        stacks = await asyncio.to_thread(_sample, threading.get_ident(), seconds)
+        text = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        return web.Response(text=text + "\n", content_type="text/plain")
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ))
+
+
+def _memory_diff(baseline, group: str, limit: int):
+    snapshot = _snapshot()
+    stats = snapshot.compare_to(baseline, group)[:limit]
+    top = [
+        {
+            "where": str(stat.traceback[0]) if group == "lineno" else stat.traceback[0].filename,
+            "size_kb": round(stat.size / 1024, 1),
+            "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "count": stat.count,
+            "count_diff": stat.count_diff,
+        }
+        for stat in stats
+    ]
+    return snapshot, top
+
+
+@admin_only
+async def memory_endpoint(request: web.Request):
+    """GET /admin/memory?group=lineno|filename&limit=N - рост памяти с прошлого вызова
+
+    Первый вызов включает tracemalloc и запоминает исходный снимок,
+    ?stop=1 выключает его (трассировка замедляет аллокации).
+    """
+    global _memory_baseline
+
+    if request.query.get("stop"):
+        tracemalloc.stop()
+        _memory_baseline = None
+        return web.json_response({"tracing": False})
+
+    group = request.query.get("group", "lineno")
+    if group not in ("lineno", "filename"):
+        return web.json_response({"error": "group must be lineno or filename"}, status=400)
+    try:
+        limit = int(request.query.get("limit", "30"))
+    except ValueError:
+        return web.json_response({"error": "limit must be a number"}, status=400)
+
+    if not tracemalloc.is_tracing() or _memory_baseline is None:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        _memory_baseline = await asyncio.to_thread(_snapshot)
+        return web.json_response({"tracing": True, "baseline": True})
+
+    # Снимок и сравнение - в потоке, чтобы не держать цикл
+    _memory_baseline, top = await asyncio.to_thread(_memory_diff, _memory_baseline, group, limit)
+    current, peak = tracemalloc.get_traced_memory()
+    return web.json_response({
+        "tracing": True,
+        "traced_kb": round(current / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "top": top,
+    })
+
+
+def register_runtime_gauges(storage):
+    """Gauges, по которым видны утечки: записи FSM и живые asyncio-задачи"""
+    metrics.register_gauge("fsm_storage_entries", lambda: len(storage.storage))
+    metrics.register_gauge("asyncio_tasks_live", lambda: len(asyncio.all_tasks()))
+
+
+class LoopLagMonitor:
+    """Замечать, когда event loop занят дольше LOOP_LAG_MS
+
+    Корутина в цикле отмечает пульс, сторожевой поток проверяет его и при
+    зависании пишет в лог стек потока цикла - то, что его сейчас держит.
+    """
+
+    def __init__(self, threshold_ms: float = LOOP_LAG_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = self.threshold / 4
+        self.last_beat = time.monotonic()
+        self.loop_thread = None
+        self.max_lag = 0.0
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            self.last_beat = started
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - started - self.interval
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self.last_beat
+            if stalled < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            # Один раз за зависание: стек потока цикла прямо сейчас
+            reported = True
+            metrics.inc("event_loop_stalls_total")
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            logger.warning(
+                "Event loop blocked",
+                extra={"blocked_ms": round(stalled * 1000), "stack": stack}
+            )
+
+    def start(self):
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True)
+        self._watchdog.start()
+        metrics.register_gauge("event_loop_lag_max_seconds", self._take_max_lag)
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    def _take_max_lag(self):
+        # Максимум с прошлого чтения /metrics
+        lag, self.max_lag = self.max_lag, 0.0
+        return lag
+
+
+loop_monitor = LoopLagMonitor()
+
+
+def setup_admin_routes(app: web.Application):
+    """Зарегистрировать админские маршруты, если задан ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        return
+    app.router.add_get("/admin/profile", profile_endpoint)
+    app.router.add_get("/admin/memory", memory_endpoint)
@@ -0,0 +1,235 @@
+"""
+Повторяющиеся задачи: шаблоны в recurring_tasks превращаются в задачи и покупки
+
+Все шаблоны обслуживает один таймер: min-куча по next_run_at, в которую
+загружаются шаблоны, срабатывающие в ближайший час.
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from db import connection
+
+logger = logging.getLogger(__name__)
+
+# На сколько вперёд загружаем шаблоны в кучу
+HORIZON = timedelta(hours=1)
+
+WEEKDAYS = {
+    'пн': 1, 'вт': 2, 'ср': 3, 'чт': 4, 'пт': 5, 'сб': 6, 'вс': 0,
+    'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6, 'sun': 0
+}
+
+DAILY_WORDS = ('ежедневно', 'каждый день', 'daily')
+
+# Диапазоны полей cron: минуты, часы, день месяца, месяц, день недели
+CRON_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def _parse_field(field: str, low: int, high: int):
+    """Разобрать поле cron (*, списки, диапазоны, шаги); None - любое значение"""
+    if field == '*':
+        return None
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-'))
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"значение вне диапазона {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_cron(expr: str) -> list:
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError("нужно 5 полей: минуты часы день месяц день_недели")
+    parsed = [_parse_field(f, low, high) for f, (low, high) in zip(fields, CRON_RANGES)]
+    # В cron воскресенье можно записать и как 7
+    if parsed[4] is not None and 7 in parsed[4]:
+        parsed[4] = (parsed[4] - {7}) | {0}
+    return parsed
+
+
+def parse_schedule(text: str) -> str:
+    """Привести расписание пользователя к выражению cron
+
+    Понимает «ежедневно 09:00», «вт 09:00» и обычный cron «0 9 * * 2».
+    """
+    text = " ".join(text.lower().split())
+
+    for word in DAILY_WORDS:
+        if text.startswith(word):
+            hour, minute = _parse_time(text[len(word):].strip() or "09:00")
+            return f"{minute} {hour} * * *"
+
+    parts = text.split()
+    if parts and parts[0] in WEEKDAYS:
+        hour, minute = _parse_time(parts[1] if len(parts) > 1 else "09:00")
+        return f"{minute} {hour} * * {WEEKDAYS[parts[0]]}"
+
+    parse_cron(text)
+    return text
+
+
+def _parse_time(value: str):
+    hour, minute = map(int, value.split(':'))
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        raise ValueError("время должно быть в формате ЧЧ:ММ")
+    return hour, minute
+
+
+def next_run(expr: str, after: datetime) -> datetime:
+    """Следующий момент срабатывания cron строго после after"""
+    minutes, hours, days, months, weekdays = parse_cron(expr)
+    start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+    # Перебираем дни, а внутри дня - только подходящие часы и минуты
+    for offset in range(366 * 5):
+        day = start.date() + timedelta(days=offset)
+        if months is not None and day.month not in months:
+            continue
+        dom_ok = days is None or day.day in days
+        dow_ok = weekdays is None or (day.weekday() + 1) % 7 in weekdays
+        # Как в cron: если заданы оба поля, достаточно совпадения любого
+        if days is not None and weekdays is not None:
+            if not (dom_ok or dow_ok):
+                continue
+        elif not (dom_ok and dow_ok):
+            continue
+
+        for hour in sorted(hours) if hours is not None else range(24):
+            for minute in sorted(minutes) if minutes is not None else range(60):
+                candidate = datetime.combine(day, datetime.min.time()).replace(hour=hour, minute=minute)
+                if candidate >= start:
+                    return candidate
+
+    raise ValueError("расписание никогда не срабатывает")
+
+
+class RecurringScheduler:
+    """Один таймер на все шаблоны"""
+
+    def __init__(self):
+        self.heap = []
+        # id -> (next_run_at, schedule); записи кучи с другим временем устарели
+        self.templates = {}
+        self.wakeup = asyncio.Event()
+        self.loaded_until = None
+
+    def push(self, template_id: int, run_at: datetime, schedule: str):
+        """Поставить шаблон в кучу, если он попадает в загруженный горизонт"""
+        if self.loaded_until is None or run_at > self.loaded_until:
+            return
+        self.templates[template_id] = (run_at, schedule)
+        heapq.heappush(self.heap, (run_at, template_id))
+        self.wakeup.set()
+
+    def forget(self, template_id: int):
+        self.templates.pop(template_id, None)
+
+    async def load(self):
+        """Загрузить из индекса по next_run_at шаблоны ближайшего горизонта"""
+        until = datetime.now() + HORIZON
+        async with connection() as conn:
+            rows = await conn.fetch(
+                """SELECT id, next_run_at, schedule FROM recurring_tasks
+                   WHERE active AND next_run_at <= $1""",
+                until
+            )
+
+        self.heap = [(r['next_run_at'], r['id']) for r in rows]
+        heapq.heapify(self.heap)
+        self.templates = {r['id']: (r['next_run_at'], r['schedule']) for r in rows}
+        self.loaded_until = until
+
+    async def materialize(self, due: list):
+        """Создать задачи для всех наступивших шаблонов одним запросом
+
+        UPDATE сдвигает next_run_at только если он не изменился с момента
+        загрузки, поэтому при нескольких репликах задача создаётся один раз.
+        """
+        ids = [template_id for template_id, _, _ in due]
+        due_at = [run_at for _, run_at, _ in due]
+        next_at = [next_run(schedule, max(run_at, datetime.now())) for _, run_at, schedule in due]
+
+        async with connection() as conn:
+            created = await conn.fetchval(
+                """
+                WITH claimed AS (
+                    UPDATE recurring_tasks r SET next_run_at = u.next_at
+                    FROM unnest($1::int[], $2::timestamp[], $3::timestamp[]) AS u(id, due_at, next_at)
+                    WHERE r.id = u.id AND r.next_run_at = u.due_at AND r.active
+                    RETURNING r.family_id, r.kind, r.text, r.assigned_to, r.created_by
+                ), new_tasks AS (
+                    INSERT INTO tasks (family_id, text, created_by, assigned_to)
+                    SELECT family_id, text, created_by, assigned_to FROM claimed WHERE kind = 'task'
+                    RETURNING id
+                ), new_shopping AS (
+                    INSERT INTO shopping (family_id, text, created_by, assigned_to)
+                    SELECT family_id, text, created_by, assigned_to FROM claimed WHERE kind = 'shopping'
+                    RETURNING id
+                )
+                SELECT (SELECT COUNT(*) FROM new_tasks) + (SELECT COUNT(*) FROM new_shopping)
+                """,
+                ids, due_at, next_at
+            )
+
+        for (template_id, _, schedule), run_at in zip(due, next_at):
+            self.push(template_id, run_at, schedule)
+
+        logger.info("Recurring tasks materialized", extra={"materialized": created, "due": len(due)})
+
+    async def run(self):
+        while True:
+            now = datetime.now()
+            if self.loaded_until is None or now >= self.loaded_until - HORIZON / 2:
+                try:
+                    await self.load()
+                except Exception:
+                    logger.exception("Failed to load recurring tasks")
+                    await asyncio.sleep(60)
+                    continue
+
+            # Забираем все наступившие шаблоны
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                run_at, template_id = heapq.heappop(self.heap)
+                current = self.templates.get(template_id)
+                if current and current[0] == run_at:
+                    del self.templates[template_id]
+                    due.append((template_id, run_at, current[1]))
+
+            if due:
+                try:
+                    await self.materialize(due)
+                except Exception:
+                    logger.exception("Failed to materialize recurring tasks")
+
+            # Спим до ближайшего шаблона, перезагрузки горизонта или нового шаблона
+            wake_at = self.loaded_until - HORIZON / 2 if self.loaded_until else now + timedelta(minutes=1)
+            if self.heap:
+                wake_at = min(wake_at, self.heap[0][0])
+            timeout = max((wake_at - datetime.now()).total_seconds(), 0)
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+scheduler = RecurringScheduler()
+
+
+async def schedule_recurring_tasks():
+    """Фоновый цикл повторяющихся задач"""
+    await scheduler.run()
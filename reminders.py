@@ -0,0 +1,106 @@
+"""
+Диспетчер напоминаний о сроках задач и покупок
+
+Каждая реплика опрашивает частичный индекс по remind_at и забирает пачку
+через FOR UPDATE SKIP LOCKED, так что одно напоминание уходит один раз.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from db import bot, connection
+import drain
+
+logger = logging.getLogger(__name__)
+
+# Сколько напоминаний забираем за раз и как часто опрашиваем
+BATCH_SIZE = 100
+POLL_INTERVAL = 15
+
+# Одновременных отправок в Telegram
+SEND_CONCURRENCY = 20
+
+# Тип -> (таблица, эмодзи)
+REMINDER_TABLES = {
+    'task': ('tasks', '📋'),
+    'shopping': ('shopping', '🛒')
+}
+
+
+async def claim_due(conn, table: str, now: datetime) -> list:
+    """Забрать пачку наступивших напоминаний и пометить их отправленными"""
+    async with conn.transaction():
+        return await conn.fetch(
+            f"""
+            WITH due AS (
+                SELECT id FROM {table}
+                WHERE remind_at <= $1 AND NOT completed AND NOT reminded
+                ORDER BY remind_at
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE {table} t SET reminded = true
+            FROM due WHERE t.id = due.id
+            RETURNING t.id, t.family_id, t.text, t.assigned_to, t.due_at
+            """,
+            now, BATCH_SIZE
+        )
+
+
+async def dispatch_reminders() -> int:
+    """Отправить одну пачку напоминаний; вернуть число забранных записей"""
+    now = datetime.now()
+    claimed = []
+
+    async with connection() as conn:
+        for table, emoji in REMINDER_TABLES.values():
+            claimed += [(emoji, r) for r in await claim_due(conn, table, now)]
+
+        if not claimed:
+            return 0
+
+        # Участники всех затронутых семей - одним запросом
+        family_ids = list({r['family_id'] for _, r in claimed})
+        members = await conn.fetch(
+            "SELECT family_id, user_id FROM family_members WHERE family_id = ANY($1::int[])",
+            family_ids
+        )
+
+    family_members = {}
+    for m in members:
+        family_members.setdefault(m['family_id'], []).append(m['user_id'])
+
+    semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+
+    async def send(user_id: int, text: str):
+        async with semaphore:
+            try:
+                await bot.send_message(user_id, text)
+            except Exception as e:
+                logger.warning("Failed to send reminder: %s", e, extra={"recipient": user_id})
+
+    sends = []
+    for emoji, r in claimed:
+        due = r['due_at'].strftime('%d.%m %H:%M') if r['due_at'] else "сейчас"
+        text = f"⏰ Напоминание ({due}):\n\n{emoji} «{r['text']}»"
+        recipients = [r['assigned_to']] if r['assigned_to'] else family_members.get(r['family_id'], [])
+        sends += [send(user_id, text) for user_id in recipients]
+
+    await asyncio.gather(*sends)
+    logger.info("Reminders dispatched", extra={"items": len(claimed), "messages": len(sends)})
+    return len(claimed)
+
+
+async def schedule_reminders():
+    """Фоновый опрос напоминаний"""
+    while True:
+        try:
+            claimed = await asyncio.shield(drain.spawn(dispatch_reminders()))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Reminder dispatch failed")
+            claimed = 0
+
+        # Полная пачка - значит есть ещё, забираем сразу
+        if claimed < BATCH_SIZE:
+            await asyncio.sleep(POLL_INTERVAL)
@@ -1,16 +1,22 @@
 """
-Планировщик задач для отправки ежедневных дайджестов
+Планировщик фоновых заданий: ежедневный дайджест, пересчёт статистики, архивация
 """
 import asyncio
-from datetime import datetime, time
-from db import bot, get_pool
+import logging
+from datetime import datetime, time, timedelta
+from config import ARCHIVE_AFTER_DAYS
+from db import bot, connection, read_connection
+import drain
+from log import sampled
+
+logger = logging.getLogger(__name__)
 
 
 async def send_daily_digest():
     """Отправка ежедневного дайджеста всем членам семей"""
-    print(f"[{datetime.now()}] Sending daily digest...")
+    logger.info("Sending daily digest")
     
-    async with get_pool().acquire() as conn:
+    async with read_connection() as conn:
         # Получаем все семьи
         families = await conn.fetch("SELECT id, name FROM families")
         
@@ -81,11 +87,11 @@ async def send_daily_digest():
             for member in members:
                 try:
                     await bot.send_message(member["user_id"], digest)
-                    print(f"Digest sent to {member['user_id']}")
+                    sampled(logger, "digest_sent", 100, "Digest sent", recipient=member['user_id'])
                 except Exception as e:
-                    print(f"Failed to send digest to {member['user_id']}: {e}")
+                    logger.warning("Failed to send digest: %s", e, extra={"recipient": member['user_id']})
     
-    print(f"[{datetime.now()}] Daily digest sent!")
+    logger.info("Daily digest sent")
 
 
 async def schedule_daily_digest():
@@ -99,15 +105,178 @@ async def schedule_daily_digest():
         target_datetime = datetime.combine(now.date(), target_time)
         if now.time() > target_time:
             # Если уже прошло 20:00, планируем на завтра
-            from datetime import timedelta
             target_datetime += timedelta(days=1)
         
         wait_seconds = (target_datetime - now).total_seconds()
         
-        print(f"Next digest scheduled at {target_datetime} (in {wait_seconds/3600:.1f} hours)")
+        logger.info("Next digest scheduled", extra={"at": target_datetime.isoformat(), "wait_hours": round(wait_seconds / 3600, 1)})
         
         # Ждём до назначенного времени
         await asyncio.sleep(wait_seconds)
         
-        # Отправляем дайджест
-        await send_daily_digest()
+        # Отправляем дайджест (shield: отмена планировщика не обрывает рассылку)
+        await asyncio.shield(drain.spawn(send_daily_digest()))
+
+
+# Как часто дополнять агрегаты статистики
+STATS_ROLLUP_INTERVAL = 300
+
+
+async def refresh_stats_rollup():
+    """Добавить в member_daily_stats выполненное после водяного знака
+    
+    Полную историю не пересчитываем: берём только строки с completed_at
+    между прошлым водяным знаком и (NOW() - 1 минута), чтобы не потерять
+    транзакции, которые ещё не закоммичены.
+    """
+    async with connection() as conn:
+        async with conn.transaction():
+            # Одна реплика за раз, иначе строки посчитаются дважды
+            # Ожидание блокировки и первый проход по всей истории дольше
+            # обычного statement_timeout
+            await conn.execute("SET LOCAL statement_timeout = 0")
+            await conn.execute(
+                "SELECT pg_advisory_xact_lock(hashtext('member_daily_stats'))",
+                timeout=STATS_ROLLUP_INTERVAL
+            )
+            
+            since = await conn.fetchval(
+                "SELECT value FROM stats_watermark WHERE name='member_daily_stats'"
+            )
+            until = await conn.fetchval("SELECT (NOW() - INTERVAL '1 minute')::timestamp")
+            
+            result = await conn.execute(
+                """
+                INSERT INTO member_daily_stats (family_id, user_id, day, kind, completed, total_seconds)
+                SELECT family_id,
+                       COALESCE(completed_by, assigned_to, created_by, 0),
+                       completed_at::date,
+                       kind,
+                       COUNT(*),
+                       COALESCE(SUM(EXTRACT(EPOCH FROM completed_at - created_at)), 0)
+                FROM (
+                    SELECT family_id, completed_by, assigned_to, created_by,
+                           created_at, completed_at, 'task' AS kind
+                    FROM tasks
+                    WHERE completed AND completed_at > $1 AND completed_at <= $2
+                    UNION ALL
+                    SELECT family_id, completed_by, assigned_to, created_by,
+                           created_at, completed_at, 'shopping' AS kind
+                    FROM shopping
+                    WHERE completed AND completed_at > $1 AND completed_at <= $2
+                ) done
+                WHERE family_id IS NOT NULL
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (family_id, day, user_id, kind) DO UPDATE SET
+                    completed = member_daily_stats.completed + EXCLUDED.completed,
+                    total_seconds = member_daily_stats.total_seconds + EXCLUDED.total_seconds
+                """,
+                since or datetime.min, until,
+                timeout=STATS_ROLLUP_INTERVAL
+            )
+            
+            await conn.execute(
+                """INSERT INTO stats_watermark (name, value) VALUES ('member_daily_stats', $1)
+                   ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value""",
+                until
+            )
+    
+    logger.info("Stats rollup refreshed", extra={"until": until, "result": result})
+
+
+async def schedule_stats_rollup():
+    """Периодически дополнять агрегаты статистики"""
+    while True:
+        try:
+            await asyncio.shield(drain.spawn(refresh_stats_rollup()))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Stats rollup failed")
+        
+        await asyncio.sleep(STATS_ROLLUP_INTERVAL)
+
+
+# Сколько строк переносим в архив за одну транзакцию и как часто запускаемся
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_INTERVAL = 3600
+
+# Тип -> (таблица, таблица чек-листа, колонка родителя в чек-листе)
+ARCHIVE_TABLES = [
+    ('tasks', 'task_checklist', 'task_id'),
+    ('shopping', 'shopping_checklist', 'shopping_id')
+]
+
+ARCHIVE_COLUMNS = """id, family_id, text, completed, created_at, completed_at,
+                     assigned_to, created_by, completed_by, due_at"""
+
+
+async def archive_batch(conn, table: str, checklist: str, fk: str, before: datetime) -> int:
+    """Перенести одну пачку выполненных строк вместе с их чек-листами в архив"""
+    async with conn.transaction():
+        ids = [r['id'] for r in await conn.fetch(
+            f"""SELECT id FROM {table}
+                WHERE completed AND completed_at < $1
+                ORDER BY completed_at
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED""",
+            before, ARCHIVE_BATCH_SIZE
+        )]
+        if not ids:
+            return 0
+        
+        # Сначала копируем родителей (на них ссылается архив чек-листов),
+        # затем чек-листы, затем удаляем - пункты уйдут каскадом
+        await conn.execute(
+            f"""INSERT INTO {table}_archive ({ARCHIVE_COLUMNS})
+                SELECT {ARCHIVE_COLUMNS} FROM {table} WHERE id = ANY($1::int[])
+                ON CONFLICT (id) DO NOTHING""",
+            ids
+        )
+        await conn.execute(
+            f"""INSERT INTO {checklist}_archive (id, {fk}, text, completed, position)
+                SELECT id, {fk}, text, completed, position FROM {checklist}
+                WHERE {fk} = ANY($1::int[])
+                ON CONFLICT (id) DO NOTHING""",
+            ids
+        )
+        await conn.execute(f"DELETE FROM {table} WHERE id = ANY($1::int[])", ids)
+    
+    return len(ids)
+
+
+async def archive_completed():
+    """Перенести в архив всё выполненное раньше ARCHIVE_AFTER_DAYS дней назад
+    
+    Не раньше водяного знака статистики, чтобы строки успели попасть в агрегаты.
+    """
+    async with connection() as conn:
+        watermark = await conn.fetchval(
+            "SELECT value FROM stats_watermark WHERE name='member_daily_stats'"
+        )
+        if watermark is None:
+            return
+        before = min(datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS), watermark)
+        
+        for table, checklist, fk in ARCHIVE_TABLES:
+            moved = 0
+            while True:
+                count = await archive_batch(conn, table, checklist, fk, before)
+                moved += count
+                if count < ARCHIVE_BATCH_SIZE or drain.is_draining():
+                    break
+            if moved:
+                logger.info("Archived rows", extra={"table": table, "rows": moved})
+
+
+async def schedule_archiver():
+    """Периодически переносить выполненное в архив"""
+    while True:
+        try:
+            await asyncio.shield(drain.spawn(archive_completed()))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Archiver failed")
+        
+        await asyncio.sleep(ARCHIVE_INTERVAL)
@@ -0,0 +1,131 @@
+"""
+Микробенчмарк маршрутизации: цепочка F.data.startswith + split против таблицы префиксов
+
+Считает только стоимость выбора хендлера и разбора данных на один апдейт,
+без сети и базы.
+
+    python scripts/bench_routing.py --number 200000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench-token")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import F
+
+import callbacks
+from callbacks import Route
+from keyboards.main_meny import PARENT_BUTTONS, menu_labels
+from menu import resolve
+
+# Порядок хендлеров - как при регистрации роутеров в bot.py
+CALLBACK_ORDER = [
+    callbacks.Suggest, callbacks.Confirm, callbacks.Assign, callbacks.TaskDone,
+    callbacks.ShopDone, callbacks.ChangeRole, callbacks.RemoveMember, callbacks.HistoryPage,
+    callbacks.HistoryFilter, callbacks.Emoji, callbacks.SearchPage, callbacks.Checklist,
+    callbacks.CheckToggle, callbacks.CheckUp, callbacks.CheckAdd, callbacks.Stats,
+    callbacks.RepeatDel, callbacks.Due, callbacks.DueSet, callbacks.Bulk,
+    callbacks.BulkToggle, callbacks.BulkDone, callbacks.BulkCancel
+]
+
+SAMPLE = [
+    callbacks.TaskDone(id=1842).pack(),
+    callbacks.ShopDone(id=977).pack(),
+    callbacks.Assign(kind="task", user_id=123456789).pack(),
+    callbacks.HistoryFilter(filter_type="shopping", page=0).pack(),
+    callbacks.DueSet(kind="shopping", id=977, option="tom").pack(),
+    callbacks.BulkToggle(kind="shopping", id=977).pack(),
+    callbacks.Stats(period="week").pack(),
+    callbacks.BulkCancel().pack(),
+]
+
+
+def old_callback_route(filters, data: str):
+    """Как было: каждый фильтр по очереди, затем split в хендлере"""
+    event = SimpleNamespace(data=data)
+    for prefix, magic in filters:
+        if magic.resolve(event):
+            return prefix, data.split(":")
+    return None
+
+
+def new_callback_route(routes, data: str):
+    """Как стало: один разбор по префиксу, фильтры сравнивают тип"""
+    payload = callbacks.parse(data)
+    for route in routes:
+        if type(payload) is route.cls:
+            return payload
+    return None
+
+
+async def old_menu_route(actions, user_id: int, text: str):
+    # Каждый MenuButton сам вызывал resolve, F.text сравнивал строку
+    for action in actions:
+        if action in PARENT_BUTTONS:
+            if text == PARENT_BUTTONS[action]:
+                return action
+        elif await resolve(user_id, text) == action:
+            return action
+    return None
+
+
+async def new_menu_route(actions, user_id: int, text: str):
+    menu_action = await resolve(user_id, text)
+    for action in actions:
+        if menu_action == action:
+            return action
+    return None
+
+
+def bench(name: str, func, number: int):
+    started = time.perf_counter()
+    for i in range(number):
+        func(SAMPLE[i % len(SAMPLE)])
+    per_call = (time.perf_counter() - started) / number
+    print(f"{name:<28} {per_call * 1e6:8.2f} µs/update")
+    return per_call
+
+
+async def bench_async(name: str, func, texts: list, number: int):
+    started = time.perf_counter()
+    for i in range(number):
+        await func(1, texts[i % len(texts)])
+    per_call = (time.perf_counter() - started) / number
+    print(f"{name:<28} {per_call * 1e6:8.2f} µs/update")
+    return per_call
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    filters = []
+    for cls in CALLBACK_ORDER:
+        if cls is callbacks.BulkCancel:
+            filters.append((cls.__prefix__, F.data == cls.__prefix__))
+        else:
+            filters.append((cls.__prefix__, F.data.startswith(f"{cls.__prefix__}:")))
+    routes = [Route(cls) for cls in CALLBACK_ORDER]
+
+    print("Callback queries:")
+    old = bench("startswith chain + split", lambda d: old_callback_route(filters, d), args.number)
+    new = bench("prefix table + CallbackData", lambda d: new_callback_route(routes, d), args.number)
+    print(f"{'speedup':<28} {old / new:8.2f}x\n")
+
+    actions = ['add', 'tasks', 'shopping', 'family', 'rename', 'invite', 'history', 'settings']
+    texts = list(menu_labels().values()) + list(PARENT_BUTTONS.values()) + ["Купить молоко"]
+
+    print("Menu messages:")
+    old = await bench_async("resolve per filter", lambda u, t: old_menu_route(actions, u, t), texts, args.number)
+    new = await bench_async("resolve once per update", lambda u, t: new_menu_route(actions, u, t), texts, args.number)
+    print(f"{'speedup':<28} {old / new:8.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,215 @@
+"""
+Soak-тест: часами гонять синтетические апдейты через диспетчер и следить за памятью
+
+Bot API подменяется локальной заглушкой на aiohttp, база - настоящая
+(DATABASE_URL, лучше отдельная локальная). Нажатия кнопок берутся из
+клавиатур, которые бот сам прислал заглушке. Тест падает (код 1), если после
+прогрева RSS или число объектов растут от окна к окну.
+
+    DATABASE_URL=postgresql://localhost/family_soak python scripts/soak_test.py --duration 7200
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123456:soak-test-token")
+os.environ.setdefault("TRACE_FILE", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import TelegramMethod
+
+import bot as _app  # noqa: F401 - регистрирует роутеры и middleware
+from db import dp, bot, init_db, close_db
+from keyboards.main_meny import menu_labels
+
+# Сколько окон сравниваем после прогрева
+WINDOWS = 4
+
+_message_ids = itertools.count(1)
+_update_ids = itertools.count(1)
+# chat_id -> callback_data последней присланной клавиатуры
+_keyboards = {}
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Не Linux: пиковое значение, тоже годится для поиска роста
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def fake_message(chat_id: int, text: str) -> dict:
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"},
+        "text": text,
+    }
+
+
+async def stub_api(request: web.Request):
+    """Заглушка Bot API: отвечает правдоподобно и запоминает клавиатуры"""
+    method = request.match_info["method"].lower()
+    fields = await request.post()
+    chat_id = int(fields.get("chat_id") or 0)
+
+    markup = fields.get("reply_markup")
+    if markup and chat_id:
+        buttons = json.loads(markup).get("inline_keyboard") or []
+        data = [b["callback_data"] for row in buttons for b in row if b.get("callback_data")]
+        if data:
+            _keyboards[chat_id] = data
+
+    if method == "getchat":
+        result = {"id": chat_id, "type": "private", "first_name": f"User {chat_id}",
+                  "accent_color_id": 0, "max_reaction_count": 0}
+    elif method.startswith(("send", "edit")):
+        result = fake_message(chat_id, fields.get("text") or "")
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+def message_update(user_id: int, text: str) -> dict:
+    return {"update_id": next(_update_ids), "message": fake_message(user_id, text)}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_message_ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "chat_instance": str(user_id),
+            "message": fake_message(user_id, "..."),
+            "data": data,
+        },
+    }
+
+
+def next_update(user_id: int) -> dict:
+    """Случайное действие пользователя: меню, ввод текста или нажатие кнопки"""
+    roll = random.random()
+    keyboard = _keyboards.get(user_id)
+    if keyboard and roll < 0.4:
+        return callback_update(user_id, random.choice(keyboard))
+    if roll < 0.5:
+        return message_update(user_id, f"Купить молоко {random.randint(1, 50)}")
+    if roll < 0.55:
+        return message_update(user_id, "/start")
+    return message_update(user_id, random.choice(list(menu_labels().values())))
+
+
+async def feed(raw: dict):
+    result = await dp.feed_raw_update(bot, raw)
+    # Ответ, который ушёл бы в теле webhook, тоже прогоняем через заглушку
+    if isinstance(result, TelegramMethod):
+        await bot(result)
+
+
+def growing(values: list, tolerance: float) -> bool:
+    """Медианы окон растут каждый раз и в сумме больше допуска"""
+    size = len(values) // WINDOWS
+    if size == 0:
+        return False
+    medians = [statistics.median(values[i * size:(i + 1) * size]) for i in range(WINDOWS)]
+    return all(b > a for a, b in zip(medians, medians[1:])) and medians[-1] - medians[0] > tolerance
+
+
+async def run(args):
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", stub_api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    bot.session.api = TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")
+
+    await init_db()
+
+    users = [9_000_000 + i for i in range(args.users)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    in_flight = set()
+    errors = 0
+
+    async def one(raw):
+        nonlocal errors
+        async with semaphore:
+            try:
+                await feed(raw)
+            except Exception:
+                errors += 1
+
+    samples = []
+    started = time.monotonic()
+    next_sample = started + args.sample_every
+    try:
+        while time.monotonic() - started < args.duration:
+            task = asyncio.create_task(one(next_update(random.choice(users))))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            await asyncio.sleep(1 / args.rate)
+
+            if time.monotonic() >= next_sample:
+                next_sample += args.sample_every
+                # В боте это делает фоновая чистка, здесь on_startup не запускается
+                dp.storage.sweep()
+                gc.collect()
+                sample = {
+                    "elapsed": round(time.monotonic() - started),
+                    "rss_mb": round(rss_bytes() / 2**20, 1),
+                    "objects": len(gc.get_objects()),
+                    "tasks": len(asyncio.all_tasks()),
+                    "fsm_entries": len(dp.storage.storage),
+                    "errors": errors,
+                }
+                samples.append(sample)
+                print(json.dumps(sample), flush=True)
+    finally:
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        await close_db()
+        await runner.cleanup()
+
+    measured = samples[int(len(samples) * args.warmup):]
+    failures = []
+    if growing([s["rss_mb"] for s in measured], args.rss_tolerance_mb):
+        failures.append("RSS keeps growing")
+    objects = [s["objects"] for s in measured]
+    if objects and growing(objects, objects[0] * args.objects_tolerance):
+        failures.append("object count keeps growing")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=3600, help="сколько секунд гонять")
+    parser.add_argument("--rate", type=float, default=50, help="апдейтов в секунду")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--sample-every", type=float, default=30, help="секунд между замерами")
+    parser.add_argument("--warmup", type=float, default=0.2, help="доля замеров, которую не учитываем")
+    parser.add_argument("--rss-tolerance-mb", type=float, default=16)
+    parser.add_argument("--objects-tolerance", type=float, default=0.05, help="допустимый рост числа объектов (доля)")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Последние успешно прочитанные списки: показываем их, пока база недоступна
+
+Снимок не сбрасывается при записях: он нужен именно тогда, когда свежие
+данные получить нельзя, и показывается с пометкой о времени.
+"""
+import time
+from collections import OrderedDict
+import metrics
+
+# Сколько снимков держим (по одному на семью и вид списка)
+MAX_SNAPSHOTS = 2000
+
+_snapshots = OrderedDict()
+
+
+def remember_snapshot(key, value):
+    """Сохранить последний успешно прочитанный список"""
+    _snapshots[key] = (value, time.time())
+    _snapshots.move_to_end(key)
+    if len(_snapshots) > MAX_SNAPSHOTS:
+        _snapshots.popitem(last=False)
+
+
+def last_snapshot(key):
+    """(список, время сохранения) или None, если снимка нет"""
+    snapshot = _snapshots.get(key)
+    metrics.inc("db_stale_reads_total", hit=str(snapshot is not None).lower())
+    return snapshot
+
+
+def stale_notice(saved_at: float) -> str:
+    return f"⚠️ База недоступна, список на {time.strftime('%H:%M', time.localtime(saved_at))} может быть устаревшим\n\n"
@@ -4,3 +4,4 @@ class UserState(StatesGroup):
     confirm_type = State()
     rename_family = State()
     change_emoji = State()
+    add_checklist_item = State()
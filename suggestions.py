@@ -0,0 +1,116 @@
+"""
+Подсказки для списка покупок из истории покупок семьи
+"""
+import bisect
+import heapq
+from collections import OrderedDict
+from db import connection
+import invalidation
+
+# Сколько семей держим в памяти (наименее активные вытесняются)
+MAX_FAMILIES = 1000
+
+# Сколько различных товаров загружаем из базы при построении индекса
+MAX_ITEMS = 500
+
+
+def normalize(text: str) -> str:
+    """Привести название товара к ключу индекса"""
+    return " ".join(text.lower().split())
+
+
+class PrefixIndex:
+    """Отсортированный массив названий с частотами покупок
+    
+    Поиск по префиксу - два bisect по массиву, без обращения к базе.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.counts = {}
+        self.display = {}
+
+    def add(self, text: str, count: int = 1):
+        key = normalize(text)
+        if not key:
+            return
+        if key not in self.counts:
+            bisect.insort(self.keys, key)
+            self.counts[key] = 0
+        self.counts[key] += count
+        self.display[key] = text.strip()
+
+    def suggest(self, prefix: str, limit: int = 3) -> list:
+        """Самые частые товары, начинающиеся с prefix
+
+        Верхняя граница - максимальный код Unicode, иначе выпадут товары
+        с эмодзи сразу после префикса:
+
+        >>> index = PrefixIndex()
+        >>> index.add("Торт🎂")
+        >>> index.add("Торт")
+        >>> index.suggest("торт")
+        ['Торт🎂']
+        """
+        key = normalize(prefix)
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_left(self.keys, key + "\U0010ffff", lo)
+        # Сам введённый товар не подсказываем - отсекаем до выбора лучших
+        candidates = (k for k in self.keys[lo:hi] if k != key)
+        best = heapq.nlargest(limit, candidates, key=self.counts.__getitem__)
+        return [self.display[k] for k in best]
+
+
+_indexes = OrderedDict()
+
+
+async def get_index(family_id: int) -> PrefixIndex:
+    """Получить индекс семьи, построив его при первом обращении"""
+    index = _indexes.get(family_id)
+    if index is not None:
+        _indexes.move_to_end(family_id)
+        return index
+    
+    async with connection() as conn:
+        rows = await conn.fetch(
+            """SELECT MAX(text) AS text, COUNT(*) AS cnt
+               FROM shopping_all
+               WHERE family_id=$1 AND completed=true
+               GROUP BY lower(text)
+               ORDER BY cnt DESC
+               LIMIT $2""",
+            family_id, MAX_ITEMS
+        )
+    
+    index = PrefixIndex()
+    for r in rows:
+        index.add(r["text"], r["cnt"])
+    
+    _indexes[family_id] = index
+    if len(_indexes) > MAX_FAMILIES:
+        _indexes.popitem(last=False)
+    return index
+
+
+async def suggest(family_id: int, prefix: str, limit: int = 3) -> list:
+    """Подсказки по префиксу для семьи"""
+    index = await get_index(family_id)
+    return index.suggest(prefix, limit)
+
+
+def record_purchase(family_id: int, text: str):
+    """Учесть покупку в уже построенном индексе
+    
+    Если индекс ещё не построен, покупка попадёт в него из базы при построении.
+    """
+    index = _indexes.get(family_id)
+    if index is not None:
+        index.add(text)
+
+
+def forget_family(family_id: int):
+    """Сбросить индекс семьи (покупки изменились на другой реплике)"""
+    _indexes.pop(family_id, None)
+
+
+invalidation.subscribe("items", forget_family, _indexes.clear)
@@ -0,0 +1,71 @@
+"""
+Ограничение частоты запросов: token bucket на пользователя и на семью
+"""
+import time
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery
+import metrics
+from db import cached_family_id
+
+# Стоимость -> (скорость пополнения в секунду, ёмкость) для пользователя и для семьи.
+# Дорогие обработчики помечаются flags={"throttle": "expensive"}
+USER_BUDGETS = {
+    'cheap': (2.0, 10),
+    'expensive': (0.5, 5)
+}
+FAMILY_BUDGETS = {
+    'cheap': (10.0, 30),
+    'expensive': (2.0, 15)
+}
+
+# Сколько корзин держим, прежде чем выбросить полные
+MAX_BUCKETS = 50000
+
+_buckets = {}
+
+
+def _take(key: tuple, rate: float, capacity: int, now: float) -> bool:
+    """Забрать токен из корзины; False - корзина пуста"""
+    tokens, updated = _buckets.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens < 1:
+        _buckets[key] = (tokens, now)
+        return False
+    _buckets[key] = (tokens - 1, now)
+    return True
+
+
+def _prune(now: float):
+    """Выбросить корзины, которые уже успели бы наполниться"""
+    for key, (tokens, updated) in list(_buckets.items()):
+        budgets = USER_BUDGETS if key[0] == 'user' else FAMILY_BUDGETS
+        rate, capacity = budgets[key[2]]
+        if tokens + (now - updated) * rate >= capacity:
+            del _buckets[key]
+
+
+async def throttle_middleware(handler, event, data):
+    """Inner-middleware сообщений и callback-запросов"""
+    cost = get_flag(data, "throttle", default="cheap")
+    user = data.get("event_from_user")
+    if user is None:
+        return await handler(event, data)
+
+    now = time.monotonic()
+    if len(_buckets) > MAX_BUCKETS:
+        _prune(now)
+
+    allowed = _take(('user', user.id, cost), *USER_BUDGETS[cost], now)
+    family_id = cached_family_id(user.id)
+    if allowed and family_id is not None:
+        allowed = _take(('family', family_id, cost), *FAMILY_BUDGETS[cost], now)
+
+    if not allowed:
+        metrics.inc("throttle_requests_total", result="throttled", cost=cost)
+        if isinstance(event, CallbackQuery):
+            # Сразу гасим «часики» на кнопке
+            return event.answer("⏳ Слишком часто, подождите немного")
+        return None
+
+    metrics.inc("throttle_requests_total", result="passed", cost=cost)
+    return await handler(event, data)
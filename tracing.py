@@ -0,0 +1,176 @@
+"""
+Трассировка апдейтов: спан на апдейт, вложенные спаны на SQL, Bot API и хендлер
+
+Медленные трассы (дольше TRACE_SLOW_MS) пишутся JSON-строками в TRACE_FILE
+через отдельный поток, остальные просто выбрасываются. Поля спанов названы
+как в OTLP, чтобы файл можно было скормить коллектору.
+"""
+import asyncio
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiogram.methods import TelegramMethod
+from config import TRACE_SAMPLE_RATE, TRACE_SLOW_MS, TRACE_FILE, TRACE_FILE_MAX_BYTES
+import metrics
+
+# Больше спанов в одной трассе не храним (например, рассылка на всю семью)
+MAX_SPANS = 200
+
+# Текущая трасса и id текущего спана (родителя для вложенных)
+_trace = ContextVar("trace", default=None)
+_parent = ContextVar("trace_parent", default=None)
+
+_writer = logging.getLogger("trace")
+_writer.propagate = False
+_listener = None
+
+
+class Trace:
+    __slots__ = ("trace_id", "started", "wall_started", "spans", "dropped")
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.started = time.perf_counter()
+        self.wall_started = time.time_ns()
+        # (span_id, parent_id, name, start, end, attributes)
+        self.spans = []
+        self.dropped = 0
+
+    def add(self, span_id, parent_id, name, start, end, attributes):
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append((span_id, parent_id, name, start, end, attributes))
+
+    def to_json(self) -> str:
+        def nanos(moment):
+            return self.wall_started + int((moment - self.started) * 1e9)
+
+        return json.dumps({
+            "traceId": self.trace_id,
+            "droppedSpans": self.dropped,
+            "spans": [
+                {
+                    "spanId": span_id,
+                    "parentSpanId": parent_id,
+                    "name": name,
+                    "startTimeUnixNano": nanos(start),
+                    "endTimeUnixNano": nanos(end),
+                    "durationMs": round((end - start) * 1000, 2),
+                    "attributes": attributes,
+                }
+                for span_id, parent_id, name, start, end, attributes in self.spans
+            ],
+        }, ensure_ascii=False, default=str)
+
+
+def setup_tracing():
+    """Писать медленные трассы в файл из отдельного потока"""
+    global _listener
+    if _listener or not TRACE_FILE:
+        return
+
+    trace_queue = queue.SimpleQueue()
+    _writer.addHandler(logging.handlers.QueueHandler(trace_queue))
+    _writer.setLevel(logging.INFO)
+
+    # Процесс живёт неделями: файл ограничен, старые трассы уходят в TRACE_FILE.1
+    file_handler = logging.handlers.RotatingFileHandler(
+        TRACE_FILE, maxBytes=TRACE_FILE_MAX_BYTES, backupCount=1, encoding="utf-8"
+    )
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    _listener = logging.handlers.QueueListener(trace_queue, file_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Вложенный спан; вне трассы ничего не делает
+
+    Отдаёт словарь атрибутов, чтобы их можно было дополнить по ходу.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield attributes
+        return
+
+    span_id = os.urandom(8).hex()
+    token = _parent.set(span_id)
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        trace.add(span_id, _parent.get(), name, start, time.perf_counter(), attributes)
+
+
+def record_query(record):
+    """Query logger asyncpg: спан на каждый выполненный запрос
+
+    asyncpg вызывает его через call_soon уже после запроса, в копии контекста,
+    так что трасса та же, а начало восстанавливаем по elapsed.
+    """
+    trace = _trace.get()
+    if trace is None:
+        return
+    end = time.perf_counter()
+    attributes = {"db.statement": " ".join(record.query.split())[:200]}
+    if record.exception:
+        attributes["error"] = type(record.exception).__name__
+    trace.add(os.urandom(8).hex(), _parent.get(), "sql", end - record.elapsed, end, attributes)
+
+
+async def instrument_connection(conn):
+    """init-колбэк пула: подключить query logger к новому соединению"""
+    conn.add_query_logger(record_query)
+
+
+async def trace_update(handler, event, data):
+    """Outer-middleware апдейтов: корневой спан и запись медленных трасс"""
+    if random.random() >= TRACE_SAMPLE_RATE:
+        return await handler(event, data)
+
+    trace = Trace()
+    trace_token = _trace.set(trace)
+    try:
+        with span("update", update_id=event.update_id, event=event.event_type) as attributes:
+            result = await handler(event, data)
+            if isinstance(result, TelegramMethod):
+                attributes["webhook_reply"] = type(result).__name__
+        return result
+    finally:
+        _trace.reset(trace_token)
+        if (time.perf_counter() - trace.started) * 1000 >= TRACE_SLOW_MS:
+            # Query logger asyncpg тоже идёт через call_soon - пишем после него
+            asyncio.get_running_loop().call_soon(_write_slow, trace)
+
+
+def _write_slow(trace: Trace):
+    metrics.inc("traces_slow_total")
+    if _listener:
+        _writer.info(trace.to_json())
+
+
+async def trace_handler(handler, event, data):
+    """Inner-middleware: спан на сам хендлер (запросы, рендер, ответ)"""
+    handler_object = data.get("handler")
+    name = handler_object.callback.__name__ if handler_object else "unknown"
+    with span("handler", handler=name):
+        return await handler(event, data)
+
+
+async def trace_api_request(make_request, bot, method):
+    """Session-middleware: спан на каждый вызов Bot API"""
+    with span(f"telegram.{type(method).__name__}"):
+        return await make_request(bot, method)